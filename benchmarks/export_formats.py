@@ -0,0 +1,68 @@
+"""
+Encode time and output size of every EXPORT_FORMATS variant for a fixed image.
+
+    python benchmarks/export_formats.py [--repeat 5] [--image path/to/photo.jpg]
+
+Without --image, a deterministic 2000x1500 product-style fixture is generated
+(textured background, off-centre product), so runs are comparable over time.
+Variants are written to a temporary directory that is removed afterwards.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from export import EXPORT_FORMATS, export_variant
+
+FIXTURE_SIZE = (2000, 1500)
+
+
+def make_fixture(path: str) -> None:
+    from PIL import Image, ImageDraw, ImageFilter
+
+    rng = random.Random(0)
+    width, height = FIXTURE_SIZE
+    img = Image.new("RGB", FIXTURE_SIZE)
+    img.putdata([
+        (rng.randrange(60, 256), rng.randrange(60, 256), rng.randrange(60, 256))
+        for _ in range(width * height)
+    ])
+    img = img.filter(ImageFilter.GaussianBlur(0.6))
+
+    draw = ImageDraw.Draw(img)
+    draw.rounded_rectangle((1200, 350, 1650, 1250), radius=60, fill=(150, 40, 60), outline=(30, 10, 10), width=8)
+    draw.ellipse((1300, 450, 1550, 700), fill=(240, 220, 90))
+    for y in range(800, 1200, 40):
+        draw.line((1240, y, 1610, y), fill=(250, 250, 250), width=6)
+    img.save(path, format="JPEG", quality=92)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--image", help="Image to export instead of the generated fixture")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        image_path = args.image
+        if image_path is None:
+            image_path = os.path.join(tmp, "fixture.jpg")
+            make_fixture(image_path)
+
+        print(f"{'format':<18} {'size':>10} {'encodeMs (median)':>18} {'bytes':>9} {'budget':>9} {'quality':>8}")
+        for name, spec in EXPORT_FORMATS.items():
+            runs = [export_variant(image_path, name, output_dir=tmp) for _ in range(args.repeat)]
+            last = runs[-1]
+            print(
+                f"{name:<18} {spec['width']:>4}x{spec['height']:<5} "
+                f"{statistics.median(run['encodeMs'] for run in runs):>18.1f} "
+                f"{last['bytes']:>9} {spec['maxBytes']:>9} {last['quality']:>8}"
+            )
+
+
+if __name__ == "__main__":
+    main()
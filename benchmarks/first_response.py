@@ -0,0 +1,168 @@
+"""
+Cold boot to first webhook response: starts `main:server` under uvicorn with the
+Bot API and Gemini pointed at a local stub, POSTs one /start update to /webhook
+and reports how long the first 200 took.
+
+    python benchmarks/first_response.py [--runs 3]
+
+The stub answers instantly, so the numbers are the bot's own startup cost:
+imports, the lifespan (Application build, initialize/start, getWebhookInfo)
+and handling the first update, including the Gemini call and the reply.
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+TOKEN = "123456:benchmark"
+WEBHOOK_URL = "https://example.invalid/webhook"
+CHAT_ID = 42
+
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "Benchmark", "username": "benchmark_bot"}
+TELEGRAM_RESULTS = {
+    "getMe": BOT_USER,
+    "getWebhookInfo": {"url": WEBHOOK_URL, "has_custom_certificate": False, "pending_update_count": 0},
+    "sendMessage": {"message_id": 2, "date": 0, "chat": {"id": CHAT_ID, "type": "private"}, "text": "Hello"},
+}
+GEMINI_REPLY = {"candidates": [{"content": {"role": "model", "parts": [{"text": "Hello"}]}, "finishReason": "STOP"}]}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Bot API under /bot<token>/<method>, Gemini under /v1beta/models/..."""
+
+    protocol_version = "HTTP/1.1"
+    calls: list = []
+    started = 0.0
+
+    def _reply(self, body: dict) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self) -> None:
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        path = self.path.split("?")[0]
+        if path.startswith(f"/bot{TOKEN}/"):
+            method = path.rsplit("/", 1)[1]
+            self.calls.append((method, time.perf_counter() - self.started))
+            self._reply({"ok": True, "result": TELEGRAM_RESULTS.get(method, True)})
+        elif path.endswith(":generateContent"):
+            self.calls.append(("generateContent", time.perf_counter() - self.started))
+            self._reply(GEMINI_REPLY)
+        else:
+            self.calls.append(("gemini " + path, time.perf_counter() - self.started))
+            self._reply({"name": "models/gemini-2.5-flash"})
+
+    do_GET = _handle
+    do_POST = _handle
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_update() -> bytes:
+    return json.dumps({
+        "update_id": 1,
+        "message": {
+            "message_id": 1,
+            "date": int(time.time()),
+            "chat": {"id": CHAT_ID, "type": "private"},
+            "from": {"id": CHAT_ID, "is_bot": False, "first_name": "Benchmark"},
+            "text": "/start",
+            "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+        },
+    }).encode()
+
+
+def run_once(stub_url: str, timeout: float) -> dict:
+    port = free_port()
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(
+            os.environ,
+            TELEGRAM_BOT_TOKEN=TOKEN,
+            WEBHOOK_URL=WEBHOOK_URL,
+            TELEGRAM_BASE_URL=f"{stub_url}/bot",
+            GOOGLE_GEMINI_BASE_URL=stub_url,
+            GEMINI_API_KEY="benchmark",
+            JOBS_DB=os.path.join(tmp, "jobs.db"),
+        )
+        StubHandler.calls = []
+        StubHandler.started = started = time.perf_counter()
+        process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:server", "--port", str(port), "--log-level", "warning"],
+            cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            request = urllib.request.Request(
+                f"http://127.0.0.1:{port}/webhook", data=start_update(),
+                headers={"Content-Type": "application/json"},
+            )
+            while True:
+                if time.perf_counter() - started > timeout or process.poll() is not None:
+                    raise RuntimeError("server did not answer the webhook; run it by hand to see why")
+                sent = time.perf_counter()
+                try:
+                    with urllib.request.urlopen(request, timeout=timeout) as response:
+                        if response.status == 200:
+                            break
+                except (urllib.error.URLError, ConnectionError):
+                    time.sleep(0.01)
+            answered = time.perf_counter()
+        finally:
+            process.terminate()
+            process.wait()
+
+    return {
+        "boot": answered - started,
+        "request": answered - sent,
+        "calls": list(StubHandler.calls),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    args = parser.parse_args()
+
+    stub = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=stub.serve_forever, daemon=True).start()
+    stub_url = f"http://127.0.0.1:{stub.server_address[1]}"
+
+    try:
+        results = [run_once(stub_url, args.timeout) for _ in range(args.runs)]
+    finally:
+        stub.shutdown()
+
+    boot = [result["boot"] for result in results]
+    request = [result["request"] for result in results]
+    print(f"cold boot to first webhook 200: median {statistics.median(boot) * 1000:.0f}ms, "
+          f"min {min(boot) * 1000:.0f}ms over {args.runs} runs")
+    print(f"first webhook request alone:    median {statistics.median(request) * 1000:.0f}ms")
+
+    print("\nstub calls in the last run (ms after process start):")
+    for name, at in results[-1]["calls"]:
+        print(f"{at * 1000:>10.0f}  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Cold-start cost of `import main`, and a check that the heavy SDKs stay lazy.
+
+    python benchmarks/import_time.py [--runs 5] [--top 15]
+
+Each run imports main in a fresh interpreter under `-X importtime`. Exits with
+status 1 if google.genai or PIL were imported, since those are meant to load on
+first use (or in the background prewarm), not at startup.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+LAZY_MODULES = ("google.genai", "PIL")
+
+PROBE = f"""
+import json, sys, time
+started = time.perf_counter()
+import main
+elapsed = time.perf_counter() - started
+print(json.dumps({{
+    "seconds": elapsed,
+    "loaded": [name for name in {LAZY_MODULES!r} if name in sys.modules],
+}}))
+"""
+
+
+def run_once() -> tuple[dict, str]:
+    env = dict(os.environ)
+    # main refuses to import without these; they are never used to connect
+    env.setdefault("TELEGRAM_BOT_TOKEN", "123456:benchmark")
+    env.setdefault("WEBHOOK_URL", "https://example.invalid")
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True,
+    )
+    return json.loads(completed.stdout.strip().splitlines()[-1]), completed.stderr
+
+
+def slowest_imports(importtime_log: str, top: int) -> list[tuple[int, str]]:
+    """Modules by cumulative import microseconds, from `-X importtime` output."""
+    rows = []
+    for line in importtime_log.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        rows.append((int(cumulative), name))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    results = [run_once() for _ in range(args.runs)]
+    seconds = [result["seconds"] for result, _ in results]
+    print(f"import main: median {statistics.median(seconds) * 1000:.0f}ms, "
+          f"min {min(seconds) * 1000:.0f}ms over {args.runs} runs")
+
+    print("\nslowest modules (last run, cumulative):")
+    for cumulative, name in slowest_imports(results[-1][1], args.top):
+        print(f"{cumulative / 1000:>10.1f}ms  {name}")
+
+    loaded = sorted({name for result, _ in results for name in result["loaded"]})
+    if loaded:
+        print(f"\nFAIL: imported at startup: {', '.join(loaded)}")
+        sys.exit(1)
+    print(f"\nOK: {', '.join(LAZY_MODULES)} not imported at startup")
+
+
+if __name__ == "__main__":
+    main()
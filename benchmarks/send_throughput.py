@@ -0,0 +1,210 @@
+"""
+Outbound Bot API throughput against a local fake Bot API that enforces
+Telegram's limits, using the same HTTPXRequest pool and OutboundScheduler the
+bot runs with.
+
+    python benchmarks/send_throughput.py [--bulk 300] [--chats 100] [--groups 2] [--edits 60]
+
+A broadcast of bulk sendMessage calls (private chats and groups) runs while
+interactive editMessageText calls arrive every 50ms. The fake server answers
+429 with `retry_after` when a call breaks a limit:
+
+- global: 30 calls in any 1s window
+- private chat: 3 calls in any 3s window (1/s with a small burst)
+- group: 20 calls in any 60s window
+
+Edits count against the global limit only. Pool and retry settings come from
+the same TELEGRAM_* environment variables as main.py.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import statistics
+import sys
+import threading
+import time
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from telegram.ext import ExtBot
+
+from main import TELEGRAM_KEEPALIVE_EXPIRY, TELEGRAM_MAX_RETRIES, TELEGRAM_POOL_SIZE, build_request
+from rate_limiter import INTERACTIVE_ENDPOINTS, OutboundScheduler
+
+TOKEN = "123456:benchmark"
+GROUP_ID_BASE = -1_000_000
+EDIT_CHAT_BASE = 1_000_000
+
+GLOBAL_LIMIT = (30, 1.0)
+CHAT_LIMIT = (3, 3.0)
+GROUP_LIMIT = (20, 60.0)
+
+
+class FakeBotAPI(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    lock = threading.Lock()
+    windows: dict = defaultdict(deque)
+    rejected = 0
+    accepted = 0
+    connections = 0
+
+    def setup(self) -> None:
+        super().setup()
+        with FakeBotAPI.lock:
+            FakeBotAPI.connections += 1
+
+    @classmethod
+    def _retry_after(cls, key, limit, now: float) -> float:
+        """Seconds until `key` may send again, or 0 if it may send now."""
+        count, window = limit
+        calls = cls.windows[key]
+        while calls and now - calls[0] >= window:
+            calls.popleft()
+        return 0.0 if len(calls) < count else window - (now - calls[0])
+
+    @classmethod
+    def admit(cls, method: str, chat_id) -> float:
+        now = time.monotonic()
+        limits = [("global", GLOBAL_LIMIT)]
+        if chat_id is not None and method not in INTERACTIVE_ENDPOINTS:
+            limits.append((chat_id, GROUP_LIMIT if chat_id < 0 else CHAT_LIMIT))
+
+        with cls.lock:
+            wait = max(cls._retry_after(key, limit, now) for key, limit in limits)
+            if wait > 0:
+                cls.rejected += 1
+                return wait
+            for key, _ in limits:
+                cls.windows[key].append(now)
+            cls.accepted += 1
+            return 0.0
+
+    def _reply(self, status: int, body: dict) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self) -> None:
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0)).decode()
+        params = {key: values[0] for key, values in parse_qs(body).items()}
+        method = self.path.rsplit("/", 1)[1]
+        chat_id = int(params["chat_id"]) if "chat_id" in params else None
+
+        if method == "getMe":
+            self._reply(200, {"ok": True, "result": {"id": 123456, "is_bot": True, "first_name": "Benchmark", "username": "benchmark_bot"}})
+            return
+
+        wait = self.admit(method, chat_id)
+        if wait > 0:
+            retry_after = max(1, math.ceil(wait))
+            self._reply(429, {
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {retry_after}",
+                "parameters": {"retry_after": retry_after},
+            })
+            return
+
+        chat_type = "group" if chat_id is not None and chat_id < 0 else "private"
+        self._reply(200, {"ok": True, "result": {
+            "message_id": 1, "date": 0, "chat": {"id": chat_id, "type": chat_type}, "text": params.get("text", ""),
+        }})
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+def percentile(values, q: int) -> float:
+    if len(values) < 2:
+        return values[0] if values else float("nan")
+    return statistics.quantiles(values, n=100)[q - 1]
+
+
+async def timed(latencies: list, errors: list, call) -> None:
+    started = time.perf_counter()
+    try:
+        await call
+    except Exception as e:
+        errors.append(e)
+        return
+    latencies.append(time.perf_counter() - started)
+
+
+async def run(base_url: str, args) -> dict:
+    bot = ExtBot(
+        TOKEN,
+        base_url=f"{base_url}/bot",
+        request=build_request(),
+        rate_limiter=OutboundScheduler(max_retries=TELEGRAM_MAX_RETRIES),
+    )
+    await bot.initialize()
+    bulk, interactive, errors = [], [], []
+
+    async def edits() -> None:
+        tasks = []
+        for i in range(args.edits):
+            call = bot.edit_message_text("updated", chat_id=EDIT_CHAT_BASE + i, message_id=1)
+            tasks.append(asyncio.create_task(timed(interactive, errors, call)))
+            await asyncio.sleep(0.05)
+        await asyncio.gather(*tasks)
+
+    chats = [i + 1 for i in range(args.chats)]
+    groups = [GROUP_ID_BASE - i for i in range(args.groups)]
+    targets = [chats[i % len(chats)] for i in range(args.bulk)] + [group for group in groups for _ in range(args.group_messages)]
+
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(
+            edits(),
+            *(timed(bulk, errors, bot.send_message(chat_id, "broadcast")) for chat_id in targets),
+        )
+    finally:
+        elapsed = time.perf_counter() - started
+        await bot.shutdown()
+
+    return {"elapsed": elapsed, "bulk": bulk, "interactive": interactive, "errors": errors}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--bulk", type=int, default=300, help="sendMessage calls to private chats")
+    parser.add_argument("--chats", type=int, default=100)
+    parser.add_argument("--groups", type=int, default=2)
+    parser.add_argument("--group-messages", type=int, default=5, help="sendMessage calls per group")
+    parser.add_argument("--edits", type=int, default=60, help="interactive editMessageText calls")
+    args = parser.parse_args()
+
+    # The scheduler logs every 429 and httpx every request; keep the report readable
+    logging.getLogger().setLevel(logging.ERROR)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeBotAPI)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        result = asyncio.run(run(f"http://127.0.0.1:{server.server_address[1]}", args))
+    finally:
+        server.shutdown()
+
+    sent = len(result["bulk"]) + len(result["interactive"])
+    print(f"pool size {TELEGRAM_POOL_SIZE}, keep-alive {TELEGRAM_KEEPALIVE_EXPIRY}s, "
+          f"max retries {TELEGRAM_MAX_RETRIES}")
+    print(f"sent {sent} calls in {result['elapsed']:.2f}s: {sent / result['elapsed']:.1f} msg/s")
+    print(f"429 responses: {FakeBotAPI.rejected}, failed calls: {len(result['errors'])}, "
+          f"connections opened: {FakeBotAPI.connections}")
+    for name in ("interactive", "bulk"):
+        latencies = result[name]
+        print(f"{name:<12} n={len(latencies):<4} p50 {percentile(latencies, 50) * 1000:>8.0f}ms "
+              f"p99 {percentile(latencies, 99) * 1000:>8.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
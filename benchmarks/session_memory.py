@@ -0,0 +1,75 @@
+"""
+Bytes per user session held in memory, at several simulated user counts.
+
+    python benchmarks/session_memory.py [--sizes 10000 100000 1000000] [--turns 2]
+
+Each simulated user gets `turns` chat turns, alternating a short user message
+and a longer model reply, which is what a typical /start + one question leaves
+behind. The legacy free-form dict layout is measured alongside for comparison.
+"""
+import argparse
+import gc
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from gemini import SYSTEM_PROMPT
+from session import MODEL_ROLE, USER_ROLE, Session
+
+USER_TEXT_LEN = 80
+MODEL_TEXT_LEN = 400
+
+
+def _text(user: int, turn: int, length: int) -> str:
+    prefix = f"user {user} turn {turn} "
+    return (prefix + "x" * length)[:length]
+
+
+def make_session(user: int, turns: int) -> Session:
+    session = Session()
+    for turn in range(turns):
+        if turn % 2 == 0:
+            session.add_turn(USER_ROLE, _text(user, turn, USER_TEXT_LEN))
+        else:
+            session.add_turn(MODEL_ROLE, _text(user, turn, MODEL_TEXT_LEN))
+    return session
+
+
+def make_legacy(user: int, turns: int) -> dict:
+    history = [{"role": "user", "parts": [{"text": SYSTEM_PROMPT}]}]
+    for turn in range(turns):
+        if turn % 2 == 0:
+            history.append({"role": "user", "parts": [{"text": _text(user, turn, USER_TEXT_LEN)}]})
+        else:
+            history.append({"role": "model", "parts": [{"text": _text(user, turn, MODEL_TEXT_LEN)}]})
+    return {"chat_history": history}
+
+
+def measure(factory, users: int, turns: int) -> float:
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    sessions = {user: factory(user, turns) for user in range(users)}
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del sessions
+    return (after - before) / users
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--turns", type=int, default=2)
+    args = parser.parse_args()
+
+    print(f"{'users':>10} {'Session B/user':>15} {'legacy dict B/user':>19} {'Session total MiB':>18}")
+    for users in args.sizes:
+        compact = measure(make_session, users, args.turns)
+        legacy = measure(make_legacy, users, args.turns)
+        print(f"{users:>10} {compact:>15.0f} {legacy:>19.0f} {compact * users / 2**20:>18.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,10 +3,21 @@ import setup_logging
 import logging
 
 import os
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, CallbackQuery, InputMediaPhoto
-from telegram.ext import ContextTypes, ConversationHandler
+import asyncio
+from telegram import Bot, Update, InlineKeyboardButton, InlineKeyboardMarkup, CallbackQuery, InputMediaPhoto, InputMediaDocument
+from telegram.ext import ConversationHandler
 from telegram.constants import ChatAction
-from gemini import generate_marketing_captions, CaptionResponse, generate_marketing_images, ImageResponse
+from gemini import Caption, Image
+from tracing import span
+from export import export_post_image, ExportResponse
+from jobs import job_queue, Job, FAILED
+from session import SessionContext
+
+# Callback data handled in each selection state. Buttons carry the id of the
+# job whose result they show, e.g. `next_image:12`; messages sent before that
+# was added don't, and act on the session's current post.
+IMAGE_CHOICE_PATTERN: Final[str] = r'^((prev_image|next_image|select_image|regenerate_images)(:\d+)?|cancel_post)$'
+CAPTION_CHOICE_PATTERN: Final[str] = r'^(caption_[0-2]|regenerate_captions)(:\d+)?$'
 
 # States
 ASK_IMAGE: Final[int] = 0
@@ -15,7 +26,9 @@ CHOOSE_IMAGE: Final[int] = 2
 CHOOSE_CAPTION: Final[int] = 3
 SHOW_PREVIEW: Final[int] = 4
 
-async def create_post_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Optional[int]:
+EXPORTS_CAPTION: Final[str] = "Ready-to-post sizes: Instagram feed (1:1), Stories/Reels (9:16), WhatsApp status."
+
+async def create_post_command(update: Update, context: SessionContext) -> Optional[int]:
     """
     Entry point for the /createpost command.
     Asks user to upload an image.
@@ -28,7 +41,7 @@ async def create_post_command(update: Update, context: ContextTypes.DEFAULT_TYPE
     await update.message.reply_text("1. Please upload the image 📸 of the product.")
     return ASK_IMAGE
 
-async def ask_description(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+async def ask_description(update: Update, context: SessionContext) -> int:
     """
     Handles the uploaded image and asks for a description.
     """
@@ -37,8 +50,8 @@ async def ask_description(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return ConversationHandler.END
     
     if context.user_data is None:
-        logging.warning("No user_data found in context; initializing.")
-        context.user_data = {}
+        logging.warning("No user_data found in context; ignoring.")
+        return ConversationHandler.END
 
     if update.message is None or not update.message.photo:
         await update.message.reply_text("Please upload a valid image file.")
@@ -46,12 +59,14 @@ async def ask_description(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     
 
     photo = update.message.photo[-1]
-    file = await context.bot.get_file(photo.file_id)
     image_path: str = os.path.join("tmp/received", f"{photo.file_unique_id}.jpg")
     os.makedirs("tmp/received", exist_ok=True)
-    await file.download_to_drive(image_path)
+    with span("telegram.download", file_size=photo.file_size):
+        file = await context.bot.get_file(photo.file_id)
+        await file.download_to_drive(image_path)
 
-    context.user_data["product_image"] = image_path
+    context.user_data.clear_post()
+    context.user_data.product_image = image_path
 
     await update.message.chat.send_action(action=ChatAction.TYPING)
     await update.message.reply_text(
@@ -62,9 +77,10 @@ async def ask_description(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     )
     return ASK_DESCRIPTION
 
-async def generate_post(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+async def generate_post(update: Update, context: SessionContext) -> int:
     """
-    Handles the description, generates images and captions for user selection.
+    Handles the description and queues image generation; the images are
+    delivered to the chat by the job worker.
     """
     if update.message is None:
         logging.warning("No message found in update; ignoring.")
@@ -80,51 +96,70 @@ async def generate_post(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
         return ConversationHandler.END
     
     description: str = update.message.text
-    context.user_data["description"] = description
+    context.user_data.description = description
     
-    image_path: str = context.user_data.get("product_image", "")
+    image_path: str = context.user_data.product_image or ""
 
     if not image_path:
         await update.message.reply_text("Missing product image, please restart with /create_post.")
         return ConversationHandler.END
 
     await update.message.chat.send_action(action=ChatAction.UPLOAD_PHOTO)
-    await update.message.reply_text("🎨 Generating product images...")
-
-    # Generate images using Gemini
-    result: ImageResponse = await generate_marketing_images(image_path, description)
-
-    if result["error"]:
-        logging.error(f"Error generating images: {result['error']}")
-        return ConversationHandler.END
-
-    if not result["images"]:
-        await update.message.reply_text("No images generated. Please try again.")
-        return ConversationHandler.END
+    await submit_job(
+        "generate_marketing_images",
+        {"image_path": image_path, "description": description},
+        update.message.chat.id,
+        update.effective_user.id if update.effective_user else update.message.chat.id,
+        update.update_id
+    )
+    await update.message.reply_text("🎨 Generating product images... I'll send them here as soon as they're ready.")
 
-    # Store images for later use
-    if context.user_data is not None:
-        context.user_data["generated_images"] = result["images"]
-        context.user_data["current_image_index"] = 0
+    return CHOOSE_IMAGE
 
-    # Create navigation keyboard
-    keyboard = [
+async def submit_job(kind: str, payload: dict, chat_id: int, user_id: int, update_id: int) -> int:
+    """
+    Queue a generation job; its result is delivered to the chat by deliver_job_result.
+    The job is traced under the trace of the submitting update.
+    """
+    with span("job.submit", kind=kind):
+        return await asyncio.to_thread(job_queue.submit, kind, payload, chat_id, user_id, update_id)
+
+def callback_action(data: Optional[str]) -> Optional[str]:
+    """The button action in callback data such as `next_image:12`."""
+    return data.split(":")[0] if data else None
+
+def callback_job_id(data: Optional[str]) -> Optional[int]:
+    """The job id in callback data such as `next_image:12`, if it carries one."""
+    if not data or ":" not in data:
+        return None
+    return int(data.rsplit(":", 1)[1])
+
+def image_keyboard(job_id: Optional[int], index: int, count: int) -> InlineKeyboardMarkup:
+    """Navigation controls for image `index` of `count` from job `job_id`."""
+    suffix = f":{job_id}" if job_id is not None else ""
+    return InlineKeyboardMarkup([
         [
-            InlineKeyboardButton("<<", callback_data="prev_image"),
-            InlineKeyboardButton("1/3", callback_data="image_info"),
-            InlineKeyboardButton(">>", callback_data="next_image")
+            InlineKeyboardButton("<<", callback_data=f"prev_image{suffix}"),
+            InlineKeyboardButton(f"{index + 1}/{count}", callback_data="image_info"),
+            InlineKeyboardButton(">>", callback_data=f"next_image{suffix}")
         ],
         [
-            InlineKeyboardButton("SELECT", callback_data="select_image"),
-            InlineKeyboardButton("RE-GENERATE", callback_data="regenerate_images"),
+            InlineKeyboardButton("SELECT", callback_data=f"select_image{suffix}"),
+            InlineKeyboardButton("RE-GENERATE", callback_data=f"regenerate_images{suffix}"),
             InlineKeyboardButton("CANCEL", callback_data="cancel_post")
         ]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    ])
+
+async def send_image_choice(bot: Bot, chat_id: int, job_id: int, images: list[Image]) -> None:
+    """
+    Send the first image generated by job `job_id` with navigation controls.
+    """
+    reply_markup = image_keyboard(job_id, 0, len(images))
 
     # Send first image with navigation controls
-    with open(result["images"][0]["filePath"], "rb") as photo:
-        await update.message.reply_photo(
+    with span("telegram.upload"), open(images[0]["filePath"], "rb") as photo:
+        await bot.send_photo(
+            chat_id=chat_id,
             photo=photo,
             caption="Please review the generated images and make your selection:\n\n"
                    "• Use << >> to navigate between images\n"
@@ -134,71 +169,67 @@ async def generate_post(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
             reply_markup=reply_markup
         )
 
-    return CHOOSE_IMAGE
-
-async def handle_image_navigation(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+async def handle_image_navigation(update: Update, context: SessionContext) -> int:
     """Handle navigation between generated images."""
     if update.message is None and update.callback_query is None:
         logging.warning("No message or callback_query found in update; ignoring.")
         return ConversationHandler.END
 
     query = update.callback_query
-    if not query or not context.user_data or query.message is None:
+    if not query or context.user_data is None or query.message is None:
         logging.warning("No query or user_data found; ignoring.")
         return ConversationHandler.END
 
     await query.answer()  # Acknowledge callback query
 
-    images = context.user_data.get("generated_images", {})
-    current_idx = context.user_data.get("current_image_index", 0)
+    images = context.user_data.generated_images or []
+    current_idx = context.user_data.current_image_index
+    action = callback_action(query.data)
     
-    if query.data == "cancel_post":
+    if action == "cancel_post":
         await context.bot.send_message(
             chat_id=query.message.chat.id,
             text="Post creation cancelled."
         )
         return ConversationHandler.END
     
-    if query.data == "select_image":
-        context.user_data["selected_image"] = images[current_idx]
+    if action == "select_image":
+        context.user_data.selected_image = images[current_idx]
         # Send a new message instead of editing
         await context.bot.send_message(chat_id=query.message.chat.id, text="✅ Image selected! Now generating captions...")
         return await generate_captions(update, context)
     
-    if query.data == "regenerate_images":
+    if action == "regenerate_images":
+        if not context.user_data.product_image:
+            await context.bot.send_message(chat_id=query.message.chat.id, text="Missing product image, please restart with /create_post.")
+            return ConversationHandler.END
+
+        await submit_job(
+            "generate_marketing_images",
+            {"image_path": context.user_data.product_image, "description": context.user_data.description or ""},
+            query.message.chat.id,
+            query.from_user.id,
+            update.update_id
+        )
         # Send a new message before regenerating
         await context.bot.send_message(chat_id=query.message.chat.id, text="🔄 Regenerating images...")
-        return await generate_post(update, context)
+        return CHOOSE_IMAGE
 
     # Handle navigation
-    if query.data == "next_image":
+    if action == "next_image":
         current_idx = (current_idx + 1) % len(images)
-    elif query.data == "prev_image":
+    elif action == "prev_image":
         current_idx = (current_idx - 1) % len(images)
 
-    context.user_data["current_image_index"] = current_idx
-
-    # Create navigation keyboard
-    keyboard = [
-        [
-            InlineKeyboardButton("<<", callback_data="prev_image"),
-            InlineKeyboardButton(f"{current_idx + 1}/3", callback_data="image_info"),
-            InlineKeyboardButton(">>", callback_data="next_image")
-        ],
-        [
-            InlineKeyboardButton("SELECT", callback_data="select_image"),
-            InlineKeyboardButton("RE-GENERATE", callback_data="regenerate_images"),
-            InlineKeyboardButton("CANCEL", callback_data="cancel_post")
-        ]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    context.user_data.current_image_index = current_idx
+    reply_markup = image_keyboard(context.user_data.images_job_id, current_idx, len(images))
 
     try:
         if query.message is None:
             logging.error("No message found in query; cannot edit message.")
             return ConversationHandler.END
 
-        with open(images[current_idx]["filePath"], "rb") as photo:
+        with span("telegram.upload"), open(images[current_idx]["filePath"], "rb") as photo:
             await context.bot.edit_message_media(
                 chat_id=query.message.chat.id,
                 message_id=query.message.message_id,
@@ -218,7 +249,7 @@ async def handle_image_navigation(update: Update, context: ContextTypes.DEFAULT_
             logging.error("No message found in query; cannot send new message.")
             return ConversationHandler.END
 
-        with open(images[current_idx]["filePath"], "rb") as photo:
+        with span("telegram.upload"), open(images[current_idx]["filePath"], "rb") as photo:
             await context.bot.send_photo(
                 chat_id=query.message.chat.id,
                 photo=photo,
@@ -233,7 +264,7 @@ async def handle_image_navigation(update: Update, context: ContextTypes.DEFAULT_
     return CHOOSE_IMAGE
 
 
-async def generate_captions(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+async def generate_captions(update: Update, context: SessionContext) -> int:
     """
     Generate captions after image selection.
     """
@@ -249,43 +280,40 @@ async def generate_captions(update: Update, context: ContextTypes.DEFAULT_TYPE)
     if not query or not query.message or context.user_data is None:
         return ConversationHandler.END
 
-    await context.bot.send_message(chat_id=query.message.chat.id, text="✍️ Generating marketing captions...")
+    if not context.user_data.selected_image:
+        await context.bot.send_message(chat_id=query.message.chat.id, text="Missing product image, please restart with /create_post.")
+        return ConversationHandler.END
 
-    selected_image_dict = context.user_data.get("selected_image")
-    selected_image: str = selected_image_dict["filePath"] if selected_image_dict and "filePath" in selected_image_dict else ""
-    description = context.user_data.get("description", "")
+    selected_image: str = context.user_data.selected_image["filePath"]
+    description = context.user_data.description or ""
 
-    # Generate captions using Gemini
-    result: CaptionResponse = await generate_marketing_captions(
-        selected_image, 
-        description
+    await submit_job(
+        "generate_marketing_captions",
+        {"image_path": selected_image, "description": description},
+        query.message.chat.id,
+        query.from_user.id,
+        update.update_id
     )
+    await context.bot.send_message(chat_id=query.message.chat.id, text="✍️ Generating marketing captions...")
 
-    if result["error"]:
-        await context.bot.send_message(
-            chat_id=query.message.chat.id,
-            text=f" Error: {result['error']}"
-        )
-        return ConversationHandler.END
-
-    if not result["captions"]:
-        await context.bot.send_message(chat_id=query.message.chat.id, text="No captions generated. Please try again.")
-        return ConversationHandler.END
-
-    context.user_data["captions"] = result["captions"]
+    return CHOOSE_CAPTION
 
+async def send_caption_choice(bot: Bot, chat_id: int, job_id: int, captions: list[Caption]) -> None:
+    """
+    Send the captions generated by job `job_id` with a button for each.
+    """
     keyboard = [
-        [InlineKeyboardButton(f"Caption {i+1}", callback_data=f"caption_{i}")]
-        for i in range(len(result["captions"]))
+        [InlineKeyboardButton(f"Caption {i+1}", callback_data=f"caption_{i}:{job_id}")]
+        for i in range(len(captions))
     ]
     keyboard.append([
-        InlineKeyboardButton("RE-GENERATE", callback_data="regenerate_captions"),
+        InlineKeyboardButton("RE-GENERATE", callback_data=f"regenerate_captions:{job_id}"),
         InlineKeyboardButton("CANCEL", callback_data="cancel_post")
     ])
     reply_markup = InlineKeyboardMarkup(keyboard)
 
     caption_text = "Please choose your preferred caption:\n\n"
-    for i, caption in enumerate(result["captions"]):
+    for i, caption in enumerate(captions):
         caption_text += (
             f"*Caption {i+1}*:\n"
             f"{caption['text']}\n"
@@ -293,16 +321,40 @@ async def generate_captions(update: Update, context: ContextTypes.DEFAULT_TYPE)
             f"{' '.join(caption['hashtags'])}\n\n"
         )
 
-    await context.bot.send_message(
-        chat_id=query.message.chat.id,
+    await bot.send_message(
+        chat_id=chat_id,
         text=caption_text,
         reply_markup=reply_markup,
         parse_mode="Markdown"
     )
 
-    return CHOOSE_CAPTION
+async def deliver_job_result(bot: Bot, job: Job) -> None:
+    """
+    Send a finished job's result to its chat. Called by the job worker, possibly
+    after a restart or on a different worker than the one that submitted the job.
+    """
+    chat_id = job["chat_id"]
+
+    if job["status"] == FAILED or job["result"] is None:
+        await bot.send_message(
+            chat_id=chat_id,
+            text="Sorry, generation failed. Please try again with /create_post."
+        )
+        return
+
+    if job["kind"] == "generate_marketing_images":
+        if not job["result"]["images"]:
+            await bot.send_message(chat_id=chat_id, text="No images generated. Please try again.")
+            return
+        await send_image_choice(bot, chat_id, job["id"], job["result"]["images"])
+
+    elif job["kind"] == "generate_marketing_captions":
+        if not job["result"]["captions"]:
+            await bot.send_message(chat_id=chat_id, text="No captions generated. Please try again.")
+            return
+        await send_caption_choice(bot, chat_id, job["id"], job["result"]["captions"])
 
-async def handle_caption_choice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+async def handle_caption_choice(update: Update, context: SessionContext) -> int:
     """
     Handle the user's caption selection.
     """
@@ -318,9 +370,9 @@ async def handle_caption_choice(update: Update, context: ContextTypes.DEFAULT_TY
         logging.warning("No data found in callback_query; ignoring.")
         return ConversationHandler.END
     
-    choice = int(query.data.split("_")[1])
-    if context.user_data and "captions" in context.user_data:
-        selected_caption = context.user_data["captions"][choice]
+    choice = int(query.data.split(":")[0].split("_")[1])
+    if context.user_data is not None and context.user_data.captions:
+        selected_caption = context.user_data.captions[choice]
         
         final_caption = (
             f"{selected_caption['text']}\n\n"
@@ -332,25 +384,21 @@ async def handle_caption_choice(update: Update, context: ContextTypes.DEFAULT_TY
             logging.error("No message found in query; cannot send final post.")
             return ConversationHandler.END
         
+        if context.user_data.selected_image:
+            final_image_path: str = context.user_data.selected_image["filePath"]
+        elif context.user_data.product_image:
+            final_image_path = context.user_data.product_image
+        else:
+            logging.error("No image found to send with the caption.")
+            return ConversationHandler.END
+
         try:
-            if "selected_image" in context.user_data:
-                with open(context.user_data["selected_image"]["filePath"], "rb") as photo:
-                    await context.bot.send_photo(
-                        chat_id=query.message.chat.id,
-                        photo=photo,
-                        caption=final_caption
-                    )
-            else:
-                if "product_image" in context.user_data:
-                    with open(context.user_data["product_image"], "rb") as photo:
-                        await context.bot.send_photo(
-                            chat_id=query.message.chat.id,
-                            photo=photo,
-                            caption=final_caption
-                        )
-                else:
-                    logging.error("No image found to send with the caption.")
-        
+            with span("telegram.upload"), open(final_image_path, "rb") as photo:
+                await context.bot.send_photo(
+                    chat_id=query.message.chat.id,
+                    photo=photo,
+                    caption=final_caption
+                )
         except Exception as e:
             logging.error(f"Error sending final post: {e}")
             await context.bot.send_message(
@@ -358,10 +406,119 @@ async def handle_caption_choice(update: Update, context: ContextTypes.DEFAULT_TY
                 text="Error sending the final post. Please try again."
             )
             return ConversationHandler.END
+
+        await send_exports(context, query.message.chat.id, final_image_path)
     return ConversationHandler.END
 
 
-async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+async def send_exports(context: SessionContext, chat_id: int, image_path: str) -> None:
+    """
+    Send the Instagram and WhatsApp sized variants of the final image as one media group.
+    Sent as documents so Telegram doesn't recompress them.
+    """
+    await context.bot.send_chat_action(chat_id=chat_id, action=ChatAction.UPLOAD_DOCUMENT)
+
+    result: ExportResponse = await export_post_image(image_path)
+    if result["error"]:
+        logging.error(result["error"])
+        return
+
+    try:
+        with span("telegram.upload", files=len(result["exports"])):
+            media = []
+            for i, export in enumerate(result["exports"]):
+                with open(export["filePath"], "rb") as f:
+                    media.append(InputMediaDocument(
+                        media=f.read(),
+                        filename=export["fileName"],
+                        caption=EXPORTS_CAPTION if i == len(result["exports"]) - 1 else None
+                    ))
+            await context.bot.send_media_group(chat_id=chat_id, media=media)
+    except Exception as e:
+        logging.error(f"Error sending exported images: {e}")
+    finally:
+        for export in result["exports"]:
+            try:
+                os.remove(export["filePath"])
+            except OSError as e:
+                logging.warning(f"Could not remove export {export['filePath']}: {e}")
+
+
+async def resume_image_choice(update: Update, context: SessionContext) -> int:
+    """
+    Handle the image selection buttons. When the button belongs to a different
+    image job than the one in user_data, that job's result is loaded first. This
+    lets the conversation resume into CHOOSE_IMAGE when the images were delivered
+    after a restart or by a different worker, or on an older message.
+    """
+    query = update.callback_query
+    if query is None or update.effective_user is None or context.user_data is None:
+        logging.warning("No callback_query, user or user_data found in update; ignoring.")
+        return ConversationHandler.END
+
+    job_id = callback_job_id(query.data)
+    if job_id is not None and job_id != context.user_data.images_job_id:
+        job = await asyncio.to_thread(job_queue.get_result, job_id, update.effective_user.id, "generate_marketing_images")
+        if job is None:
+            await query.answer("This post has expired. Please start again with /create_post.")
+            return ConversationHandler.END
+        context.user_data.images_job_id = job["id"]
+        context.user_data.generated_images = job["result"]["images"]
+        context.user_data.current_image_index = 0
+        context.user_data.product_image = job["payload"]["image_path"]
+        context.user_data.description = job["payload"]["description"]
+
+    if not context.user_data.generated_images and query.data != "cancel_post":
+        await query.answer("This post has expired. Please start again with /create_post.")
+        return ConversationHandler.END
+
+    return await handle_image_navigation(update, context)
+
+async def resume_caption_choice(update: Update, context: SessionContext) -> int:
+    """
+    Handle the caption buttons, loading the button's caption job result into
+    user_data first when it isn't already there, so the conversation can resume
+    into CHOOSE_CAPTION.
+    """
+    query = update.callback_query
+    if query is None or update.effective_user is None or context.user_data is None:
+        logging.warning("No callback_query, user or user_data found in update; ignoring.")
+        return ConversationHandler.END
+
+    job_id = callback_job_id(query.data)
+    if job_id is not None and job_id != context.user_data.captions_job_id:
+        job = await asyncio.to_thread(job_queue.get_result, job_id, update.effective_user.id, "generate_marketing_captions")
+        if job is None:
+            await query.answer("This post has expired. Please start again with /create_post.")
+            return ConversationHandler.END
+        context.user_data.captions_job_id = job["id"]
+        context.user_data.captions = job["result"]["captions"]
+        context.user_data.selected_image = {
+            "fileName": os.path.basename(job["payload"]["image_path"]),
+            "filePath": job["payload"]["image_path"]
+        }
+        context.user_data.description = job["payload"]["description"]
+
+    if callback_action(query.data) == "regenerate_captions":
+        await query.answer()
+        return await generate_captions(update, context)
+
+    if not context.user_data.captions:
+        await query.answer("This post has expired. Please start again with /create_post.")
+        return ConversationHandler.END
+
+    return await handle_caption_choice(update, context)
+
+async def timeout(update: object, context: SessionContext) -> None:
+    """
+    Forget an abandoned createpost flow once the conversation times out.
+    """
+    if context.user_data is not None:
+        context.user_data.clear_post()
+    logging.info("Post creation timed out.")
+
+
+async def cancel(update: Update, context: SessionContext) -> int:
     """
     Cancels the createpost flow.
     """
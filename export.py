@@ -0,0 +1,209 @@
+from typing import Final, List, Optional, Tuple, TypedDict
+import setup_logging
+import logging
+
+import os
+import asyncio
+import time
+import multiprocessing
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor
+
+from tracing import span
+
+
+class ExportFormat(TypedDict):
+    width: int
+    height: int
+    format: str
+    maxBytes: int
+
+
+# Target sizes for the platforms sellers repost to
+EXPORT_FORMATS: Final[dict[str, ExportFormat]] = {
+    "instagram_feed": {"width": 1080, "height": 1080, "format": "JPEG", "maxBytes": 1_000_000},
+    "instagram_story": {"width": 1080, "height": 1920, "format": "JPEG", "maxBytes": 1_500_000},
+    "whatsapp_status": {"width": 720, "height": 1280, "format": "WEBP", "maxBytes": 300_000},
+}
+
+MIN_QUALITY: Final[int] = 40
+MAX_QUALITY: Final[int] = 95
+# Side of the thumbnail the crop window is searched on
+SALIENCY_SIZE: Final[int] = 128
+
+EXPORT_WORKERS: Final = int(os.getenv("EXPORT_WORKERS", "2"))
+EXPORT_DIR: Final = os.path.join("tmp", "exports")
+# forkserver is not available on Windows
+EXPORT_START_METHOD: Final = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+
+class Export(TypedDict):
+    name: str
+    fileName: str
+    filePath: str
+    bytes: int
+    quality: int
+    encodeMs: float
+
+
+class ExportResponse(TypedDict):
+    exports: List[Export]
+    error: str | None
+
+
+def _best_offset(profile: List[int], window: int) -> int:
+    """Start index of the `window`-long slice of `profile` with the largest sum."""
+    if window >= len(profile):
+        return 0
+    total = best_total = sum(profile[:window])
+    best = 0
+    for start in range(1, len(profile) - window + 1):
+        total += profile[start + window - 1] - profile[start - 1]
+        if total > best_total:
+            best, best_total = start, total
+    return best
+
+
+def smart_crop_box(img, aspect: float) -> Tuple[int, int, int, int]:
+    """
+    Largest box with the given width/height `aspect` that keeps the most edge
+    detail, i.e. the product rather than the empty background.
+    """
+    from PIL import ImageFilter
+
+    width, height = img.size
+    if width / height > aspect:
+        crop_w, crop_h = round(height * aspect), height
+    else:
+        crop_w, crop_h = width, round(width / aspect)
+
+    scale = SALIENCY_SIZE / max(width, height)
+    small = img.convert("L").resize((max(1, round(width * scale)), max(1, round(height * scale))))
+    edges = small.filter(ImageFilter.FIND_EDGES)
+    sw, sh = edges.size
+    pixels = list(edges.getdata())
+
+    if crop_w < width:
+        columns = [sum(pixels[y * sw + x] for y in range(sh)) for x in range(sw)]
+        left = round(_best_offset(columns, round(crop_w * scale)) / scale)
+        left = min(left, width - crop_w)
+        return (left, 0, left + crop_w, crop_h)
+
+    rows = [sum(pixels[y * sw:(y + 1) * sw]) for y in range(sh)]
+    top = round(_best_offset(rows, round(crop_h * scale)) / scale)
+    top = min(top, height - crop_h)
+    return (0, top, crop_w, top + crop_h)
+
+
+def _encode(img, fmt: str, quality: int) -> bytes:
+    buffer = BytesIO()
+    if fmt == "JPEG":
+        img.save(buffer, format="JPEG", quality=quality, optimize=True, progressive=True)
+    else:
+        img.save(buffer, format=fmt, quality=quality, method=4)
+    return buffer.getvalue()
+
+
+def encode_within_budget(img, fmt: str, max_bytes: int) -> Tuple[bytes, int]:
+    """
+    Binary-search the highest quality whose output fits in `max_bytes`.
+    Falls back to MIN_QUALITY if nothing fits.
+    """
+    data = _encode(img, fmt, MAX_QUALITY)
+    if len(data) <= max_bytes:
+        return data, MAX_QUALITY
+
+    low, high = MIN_QUALITY, MAX_QUALITY - 1
+    best: Optional[Tuple[bytes, int]] = None
+    while low <= high:
+        quality = (low + high) // 2
+        data = _encode(img, fmt, quality)
+        if len(data) <= max_bytes:
+            best = (data, quality)
+            low = quality + 1
+        else:
+            high = quality - 1
+    return best if best else (_encode(img, fmt, MIN_QUALITY), MIN_QUALITY)
+
+
+def export_variant(image_path: str, name: str, output_dir: str = EXPORT_DIR) -> Export:
+    """
+    Crop, resize and encode one variant of `image_path` into `output_dir`.
+    CPU-bound; runs in the export process pool.
+    """
+    from PIL import Image as PILImage
+
+    spec = EXPORT_FORMATS[name]
+    started = time.perf_counter()
+
+    with PILImage.open(image_path) as source:
+        img = source.convert("RGB")
+    img = img.crop(smart_crop_box(img, spec["width"] / spec["height"]))
+    img = img.resize((spec["width"], spec["height"]), PILImage.Resampling.LANCZOS)
+    data, quality = encode_within_budget(img, spec["format"], spec["maxBytes"])
+
+    extension = "jpg" if spec["format"] == "JPEG" else spec["format"].lower()
+    fname = f"{os.path.splitext(os.path.basename(image_path))[0]}_{name}.{extension}"
+    fpath = os.path.join(output_dir, fname)
+    os.makedirs(output_dir, exist_ok=True)
+    with open(fpath, "wb") as f:
+        f.write(data)
+
+    return {
+        "name": name,
+        "fileName": fname,
+        "filePath": fpath,
+        "bytes": len(data),
+        "quality": quality,
+        "encodeMs": round((time.perf_counter() - started) * 1000, 1),
+    }
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def start_export_pool() -> ProcessPoolExecutor:
+    """
+    Create the export process pool. Called from the app lifespan; the workers
+    are not forked from this process, which by then runs the event loop and
+    HTTP client threads whose held locks a fork would copy.
+    """
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=EXPORT_WORKERS,
+            mp_context=multiprocessing.get_context(EXPORT_START_METHOD),
+        )
+    return _pool
+
+
+def shutdown_export_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+async def export_post_image(image_path: str, output_dir: str = EXPORT_DIR) -> ExportResponse:
+    """
+    Produce every EXPORT_FORMATS variant of `image_path` on the process pool,
+    keeping the PIL work off the event loop. The caller owns the written files.
+    """
+    loop = asyncio.get_running_loop()
+    pool = start_export_pool()
+
+    try:
+        with span("export", formats=len(EXPORT_FORMATS)):
+            exports: List[Export] = list(await asyncio.gather(*(
+                loop.run_in_executor(pool, export_variant, image_path, name, output_dir)
+                for name in EXPORT_FORMATS
+            )))
+    except Exception as e:
+        return {"exports": [], "error": f"Error exporting image: {e}"}
+
+    for export in exports:
+        logging.info(
+            f"Exported {export['name']}: {export['bytes']} bytes at quality {export['quality']} "
+            f"in {export['encodeMs']}ms"
+        )
+    return {"exports": exports, "error": None}
@@ -1,24 +1,53 @@
-from typing import Final, List, TypedDict, Any
+from typing import List, TypedDict, Any, Optional, TYPE_CHECKING
 
 import logging
 import setup_logging 
 
-from google import genai
-
 import os
 import json
+import asyncio
 from io import BytesIO
-from dotenv import load_dotenv
-from PIL import Image as PILImage
 
 
 from tools import FUNCTION_DECLARATIONS
+from tracing import span
+
+if TYPE_CHECKING:
+    from google import genai
+    from PIL import Image as PILImage
+
+_client: Optional["genai.Client"] = None
+
+
+def get_client() -> "genai.Client":
+    """
+    Return the shared Gemini client, building it on first use.
+    The google-genai import and client construction are deferred so that
+    importing this module stays cheap on cold start.
+    """
+    global _client
+    if _client is None:
+        from google import genai
+        _client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+    return _client
 
-load_dotenv()
 
-GEMINI_API_KEY: Final = os.getenv("GEMINI_API_KEY")
+def _import_heavy() -> None:
+    from PIL import Image as PILImage  # noqa: F401
+    get_client()
 
-client = genai.Client(api_key=GEMINI_API_KEY)
+
+async def prewarm() -> None:
+    """
+    Build the Gemini client, import PIL and open a connection to the Gemini
+    API ahead of the first request.
+    """
+    await asyncio.to_thread(_import_heavy)
+
+    try:
+        await get_client().aio.models.get(model="gemini-2.5-flash")
+    except Exception as e:
+        logging.warning(f"Gemini prewarm failed: {e}")
 
 
 SYSTEM_PROMPT = (
@@ -37,10 +66,11 @@ async def get_gemini_response(history: Any) -> str:
     """
     Send the full conversation history to Gemini and return the model's response.
     """
-    response = client.models.generate_content(
-        model="gemini-2.5-flash",
-        contents=history,
-    )
+    with span("gemini.generate_content", model="gemini-2.5-flash"):
+        response = await get_client().aio.models.generate_content(
+            model="gemini-2.5-flash",
+            contents=history,
+        )
 
     if not response.text:
         return "No response from Gemini API."
@@ -86,13 +116,14 @@ async def generate_marketing_captions(image_path: str, description: str) -> Capt
     """
 
     try:
-        response = client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=[{
-                "role": "user",
-                "parts": [{"text": prompt}]
-            }],
-        )
+        with span("gemini.generate_content", model="gemini-2.5-flash"):
+            response = await get_client().aio.models.generate_content(
+                model="gemini-2.5-flash",
+                contents=[{
+                    "role": "user",
+                    "parts": [{"text": prompt}]
+                }],
+            )
 
         if not response.text:
             return {"captions": [], "error": "No response from Gemini API"}
@@ -107,9 +138,17 @@ async def generate_marketing_captions(image_path: str, description: str) -> Capt
     except Exception as e:
         return {"captions": [], "error": f"Error generating captions: {str(e)}"}
 
+def _load_image(source: Any) -> "PILImage.Image":
+    """Decode an image to RGB. Blocking; run it through asyncio.to_thread."""
+    from PIL import Image as PILImage
+
+    with PILImage.open(source) as img:
+        return img.convert("RGB")
+
 async def generate_marketing_images(image_path: str, description: str) -> ImageResponse:
     try:
-        input_image = PILImage.open(image_path)
+        with span("pil.decode"):
+            input_image = await asyncio.to_thread(_load_image, image_path)
 
         base_prompts = [
             (
@@ -132,19 +171,22 @@ async def generate_marketing_images(image_path: str, description: str) -> ImageR
 
         for i, prompt in enumerate(base_prompts, start=1):
             try:
-                response = client.models.generate_content(
-                    model="gemini-2.5-flash-image-preview",
-                    contents=[prompt, input_image],  
-                )
+                with span("gemini.generate_content", model="gemini-2.5-flash-image-preview", prompt_index=i):
+                    response = await get_client().aio.models.generate_content(
+                        model="gemini-2.5-flash-image-preview",
+                        contents=[prompt, input_image],  
+                    )
                 if response.candidates and response.candidates[0].content and response.candidates[0].content.parts:
                     for part in response.candidates[0].content.parts:
                         if getattr(part, "inline_data", None) and part.inline_data and part.inline_data.data:
                             data_bytes = part.inline_data.data
                             try:
-                                img = PILImage.open(BytesIO(data_bytes)).convert("RGB")
+                                with span("pil.decode", bytes=len(data_bytes)):
+                                    img = await asyncio.to_thread(_load_image, BytesIO(data_bytes))
                                 fname = f"generated_marketing_{i}_{os.path.splitext(os.path.basename(image_path))[0]}.jpeg"
                                 fpath = os.path.join("tmp", "generated", fname)
-                                img.save(fpath, format="JPEG")
+                                with span("jpeg.encode"):
+                                    await asyncio.to_thread(img.save, fpath, format="JPEG")
                                 out_images.append({"fileName": fname, "filePath": fpath})
                                 logging.info(f"Generated and saved image: {fpath}")
                                 break
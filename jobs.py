@@ -0,0 +1,345 @@
+from typing import Any, Awaitable, Callable, Dict, Final, Optional, TypedDict
+import setup_logging
+import logging
+
+import os
+import json
+import time
+import uuid
+import asyncio
+import sqlite3
+from contextlib import closing
+
+from telegram import Bot
+
+from gemini import generate_marketing_images, generate_marketing_captions
+from tracing import trace
+
+JOBS_DB: Final = os.getenv("JOBS_DB", os.path.join("tmp", "jobs.db"))
+JOB_LEASE_SECONDS: Final = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+JOB_MAX_ATTEMPTS: Final = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_CONCURRENCY: Final = int(os.getenv("JOB_CONCURRENCY", "2"))
+JOB_POLL_INTERVAL: Final = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+# A failed attempt waits JOB_RETRY_BACKOFF * 2 ** (attempt - 1) seconds before it is retried
+JOB_RETRY_BACKOFF: Final = float(os.getenv("JOB_RETRY_BACKOFF", "10"))
+
+# Job kinds and the coroutine that runs each; both return a dict with an "error" key.
+# They must not block the event loop: the worker's lease renewal runs on it.
+JOB_HANDLERS: Final[Dict[str, Callable[..., Awaitable[Any]]]] = {
+    "generate_marketing_images": generate_marketing_images,
+    "generate_marketing_captions": generate_marketing_captions,
+}
+
+PENDING: Final = "pending"
+RUNNING: Final = "running"
+DONE: Final = "done"
+FAILED: Final = "failed"
+
+SCHEMA: Final = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    chat_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    update_id INTEGER,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    lease_owner TEXT,
+    lease_until REAL,
+    not_before REAL,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (status, lease_until);
+CREATE INDEX IF NOT EXISTS jobs_user ON jobs (user_id, kind, status);
+"""
+
+
+class Job(TypedDict):
+    id: int
+    kind: str
+    payload: Dict[str, Any]
+    chat_id: int
+    user_id: int
+    update_id: Optional[int]
+    status: str
+    attempts: int
+    max_attempts: int
+    result: Optional[Dict[str, Any]]
+    error: Optional[str]
+    created_at: float
+
+
+def _row_to_job(row: sqlite3.Row) -> Job:
+    return {
+        "id": row["id"],
+        "kind": row["kind"],
+        "payload": json.loads(row["payload"]),
+        "chat_id": row["chat_id"],
+        "user_id": row["user_id"],
+        "update_id": row["update_id"],
+        "status": row["status"],
+        "attempts": row["attempts"],
+        "max_attempts": row["max_attempts"],
+        "result": json.loads(row["result"]) if row["result"] else None,
+        "error": row["error"],
+        "created_at": row["created_at"],
+    }
+
+
+class JobQueue:
+    """
+    Durable job queue stored in SQLite.
+
+    A job is `pending` until a worker claims it, which makes it `running` under a
+    lease. Workers renew the lease while the job runs; if a worker dies, the lease
+    expires and any worker may claim the job again. Updates after the claim only
+    apply while the caller still holds the lease, so a worker that lost its lease
+    can't overwrite or deliver a job another worker has taken over. The result is
+    stored before it is delivered, so a re-claimed job only re-delivers instead of
+    re-running. Every claim counts as an attempt, including delivery retries, and
+    failed attempts are retried with exponential backoff.
+    Methods are blocking and meant to be called through asyncio.to_thread.
+    """
+
+    def __init__(self, path: str = JOBS_DB) -> None:
+        self.path = path
+        self._schema_ready = False
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._schema_ready:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        if not self._schema_ready:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            self._schema_ready = True
+        return conn
+
+    def submit(
+        self,
+        kind: str,
+        payload: Dict[str, Any],
+        chat_id: int,
+        user_id: int,
+        update_id: Optional[int] = None,
+        max_attempts: int = JOB_MAX_ATTEMPTS,
+    ) -> int:
+        if kind not in JOB_HANDLERS:
+            raise ValueError(f"Unknown job kind: {kind}")
+
+        now = time.time()
+        with closing(self._connect()) as conn:
+            cursor = conn.execute(
+                "INSERT INTO jobs (kind, payload, chat_id, user_id, update_id, status, max_attempts, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (kind, json.dumps(payload), chat_id, user_id, update_id, PENDING, max_attempts, now, now),
+            )
+            job_id = cursor.lastrowid
+        logging.info(f"Submitted job {job_id} ({kind}) for chat {chat_id}")
+        return job_id
+
+    def claim(self, worker_id: str, lease_seconds: float = JOB_LEASE_SECONDS) -> Optional[Job]:
+        """Lease the oldest pending job that is due, or a running job whose lease has expired."""
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT * FROM jobs WHERE (status = ? AND (not_before IS NULL OR not_before <= ?)) "
+                    "OR (status = ? AND lease_until < ?) ORDER BY id LIMIT 1",
+                    (PENDING, now, RUNNING, now),
+                ).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+
+                conn.execute(
+                    "UPDATE jobs SET status = ?, lease_owner = ?, lease_until = ?, updated_at = ?, "
+                    "attempts = attempts + 1 WHERE id = ?",
+                    (RUNNING, worker_id, now + lease_seconds, now, row["id"]),
+                )
+                row = conn.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone()
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return _row_to_job(row)
+
+    def renew(self, job_id: int, worker_id: str, lease_seconds: float = JOB_LEASE_SECONDS) -> bool:
+        now = time.time()
+        with closing(self._connect()) as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET lease_until = ?, updated_at = ? WHERE id = ? AND lease_owner = ? AND status = ?",
+                (now + lease_seconds, now, job_id, worker_id, RUNNING),
+            )
+            return cursor.rowcount == 1
+
+    def save_result(self, job_id: int, worker_id: str, result: Dict[str, Any]) -> bool:
+        """Store the result; returns False if `worker_id` no longer holds the lease."""
+        with closing(self._connect()) as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET result = ?, updated_at = ? WHERE id = ? AND lease_owner = ? AND status = ?",
+                (json.dumps(result), time.time(), job_id, worker_id, RUNNING),
+            )
+            return cursor.rowcount == 1
+
+    def complete(self, job_id: int, worker_id: str) -> bool:
+        with closing(self._connect()) as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = ?, lease_owner = NULL, lease_until = NULL, updated_at = ? "
+                "WHERE id = ? AND lease_owner = ? AND status = ?",
+                (DONE, time.time(), job_id, worker_id, RUNNING),
+            )
+            return cursor.rowcount == 1
+
+    def release(self, job_id: int, worker_id: str) -> None:
+        """Hand a claimed job back without counting the attempt, e.g. on shutdown."""
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, attempts = attempts - 1, lease_owner = NULL, lease_until = NULL, "
+                "updated_at = ? WHERE id = ? AND lease_owner = ? AND status = ?",
+                (PENDING, time.time(), job_id, worker_id, RUNNING),
+            )
+
+    def fail(self, job: Job, worker_id: str, error: str, backoff: float = JOB_RETRY_BACKOFF) -> bool:
+        """
+        Record a failed attempt. Returns False only if this call marked the job
+        failed for good; True if it was put back for a delayed retry, or if
+        `worker_id` had already lost the lease and nothing was changed.
+        """
+        retry = job["attempts"] < job["max_attempts"]
+        now = time.time()
+        not_before = now + backoff * 2 ** max(job["attempts"] - 1, 0) if retry else None
+        with closing(self._connect()) as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, not_before = ?, lease_owner = NULL, lease_until = NULL, "
+                "updated_at = ? WHERE id = ? AND lease_owner = ? AND status = ?",
+                (PENDING if retry else FAILED, error, not_before, now, job["id"], worker_id, RUNNING),
+            )
+            if cursor.rowcount == 0:
+                logging.warning(f"Job {job['id']} was taken over by another worker; not recording failure")
+                return True
+        return retry
+
+    def get_result(self, job_id: int, user_id: int, kind: str) -> Optional[Job]:
+        """Job `job_id` if it is a `kind` job of the user that has a result."""
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE id = ? AND user_id = ? AND kind = ? AND result IS NOT NULL",
+                (job_id, user_id, kind),
+            ).fetchone()
+        return _row_to_job(row) if row else None
+
+
+job_queue = JobQueue()
+
+
+class JobWorker:
+    """
+    Runs queued jobs in the background of a bot process and hands each finished
+    (or finally failed) job to `deliver`, which sends the result to the chat.
+    """
+
+    def __init__(
+        self,
+        queue: JobQueue,
+        bot: Bot,
+        deliver: Callable[[Bot, Job], Awaitable[None]],
+        concurrency: int = JOB_CONCURRENCY,
+        lease_seconds: float = JOB_LEASE_SECONDS,
+        poll_interval: float = JOB_POLL_INTERVAL,
+    ) -> None:
+        self.queue = queue
+        self.bot = bot
+        self.deliver = deliver
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._slots = asyncio.Semaphore(concurrency)
+        self._tasks: set[asyncio.Task] = set()
+
+    async def run(self) -> None:
+        logging.info(f"Job worker {self.worker_id} started")
+        while True:
+            await self._slots.acquire()
+            try:
+                job = await asyncio.to_thread(self.queue.claim, self.worker_id, self.lease_seconds)
+            except Exception as e:
+                logging.error(f"Error claiming job: {e}")
+                job = None
+
+            if job is None:
+                self._slots.release()
+                await asyncio.sleep(self.poll_interval)
+                continue
+
+            task = asyncio.create_task(self._run_job(job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _keep_lease(self, job_id: int) -> None:
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            if not await asyncio.to_thread(self.queue.renew, job_id, self.worker_id, self.lease_seconds):
+                logging.warning(f"Lost lease on job {job_id}")
+                return
+
+    async def _run_job(self, job: Job) -> None:
+        lease = asyncio.create_task(self._keep_lease(job["id"]))
+        try:
+            with trace("job", update_id=job["update_id"], job_id=job["id"], kind=job["kind"], attempt=job["attempts"]):
+                if job["attempts"] > job["max_attempts"]:
+                    # A previous worker died while holding the last attempt
+                    if await asyncio.to_thread(self.queue.fail, job, self.worker_id, job["error"] or "Worker lost"):
+                        return
+                    job["status"] = FAILED
+                elif job["result"] is None:
+                    try:
+                        result = await JOB_HANDLERS[job["kind"]](**job["payload"])
+                        error = result.get("error")
+                    except Exception as e:
+                        result, error = None, f"{type(e).__name__}: {e}"
+
+                    if error or result is None:
+                        logging.error(f"Job {job['id']} attempt {job['attempts']} failed: {error}")
+                        if await asyncio.to_thread(self.queue.fail, job, self.worker_id, error or "No result"):
+                            return
+                        job["status"], job["error"] = FAILED, error
+                    else:
+                        if not await asyncio.to_thread(self.queue.save_result, job["id"], self.worker_id, result):
+                            logging.warning(f"Job {job['id']} was taken over by another worker; dropping its result")
+                            return
+                        job["result"] = result
+                elif not await asyncio.to_thread(self.queue.renew, job["id"], self.worker_id, self.lease_seconds):
+                    logging.warning(f"Job {job['id']} was taken over by another worker; not delivering")
+                    return
+
+                await self.deliver(self.bot, job)
+                if job["status"] != FAILED:
+                    await asyncio.to_thread(self.queue.complete, job["id"], self.worker_id)
+                logging.info(
+                    f"Job {job['id']} ({job['kind']}) finished after {job['attempts']} attempt(s), "
+                    f"{time.time() - job['created_at']:.1f}s after submission"
+                )
+        except asyncio.CancelledError:
+            await asyncio.to_thread(self.queue.release, job["id"], self.worker_id)
+            raise
+        except Exception as e:
+            logging.error(f"Error running job {job['id']}: {e}")
+            await asyncio.to_thread(self.queue.fail, job, self.worker_id, f"{type(e).__name__}: {e}")
+        finally:
+            lease.cancel()
+            self._slots.release()
+
+    async def stop(self) -> None:
+        """Cancel running jobs and hand them back to the queue for another worker."""
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
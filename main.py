@@ -1,53 +1,69 @@
-from typing import Final
+from typing import Final, List, Optional, Tuple
 
 import setup_logging 
 import logging
 
 import os
+import asyncio
+import secrets
+import threading
+import httpx
 from dotenv import load_dotenv
 
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Request, Header, HTTPException
+from fastapi.responses import PlainTextResponse
 from contextlib import asynccontextmanager
 
 from telegram import Update
 from telegram.constants import ChatAction
-from telegram.ext import ApplicationBuilder, CommandHandler, ContextTypes, MessageHandler, filters, ConversationHandler, CallbackQueryHandler
+from telegram.request import HTTPXRequest
+from telegram.ext import Application, ApplicationBuilder, CommandHandler, ContextTypes, MessageHandler, TypeHandler, filters, ConversationHandler, CallbackQueryHandler
 
-from gemini import get_gemini_response, SYSTEM_PROMPT
-from create_post import create_post_command, generate_post, ask_description, handle_image_navigation, handle_caption_choice, cancel, ASK_IMAGE, ASK_DESCRIPTION, CHOOSE_CAPTION, CHOOSE_IMAGE
+from gemini import get_gemini_response, prewarm
+from create_post import create_post_command, generate_post, ask_description, resume_image_choice, resume_caption_choice, deliver_job_result, cancel, timeout, ASK_IMAGE, ASK_DESCRIPTION, CHOOSE_CAPTION, CHOOSE_IMAGE, IMAGE_CHOICE_PATTERN, CAPTION_CHOICE_PATTERN
 from utils import split_message
+from rate_limiter import OutboundScheduler
+from tracing import trace, flush_traces
+from profiler import sample_profile
+from export import start_export_pool, shutdown_export_pool
+from jobs import JobWorker, job_queue
+from session import Session, SessionContext, USER_ROLE, MODEL_ROLE, run_session_evictor
 
 load_dotenv()
 
 TOKEN: Final = os.getenv("TELEGRAM_BOT_TOKEN")
 BOT_USERNAME: Final = os.getenv("BOT_USERNAME")
 WEBHOOK_URL: Final = os.getenv("WEBHOOK_URL")
+TELEGRAM_BASE_URL: Final = os.getenv("TELEGRAM_BASE_URL", "https://api.telegram.org/bot")
 
+TELEGRAM_POOL_SIZE: Final = int(os.getenv("TELEGRAM_POOL_SIZE", "32"))
+TELEGRAM_POOL_TIMEOUT: Final = float(os.getenv("TELEGRAM_POOL_TIMEOUT", "10"))
+TELEGRAM_KEEPALIVE_EXPIRY: Final = float(os.getenv("TELEGRAM_KEEPALIVE_EXPIRY", "60"))
+TELEGRAM_MAX_RETRIES: Final = int(os.getenv("TELEGRAM_MAX_RETRIES", "3"))
+CONVERSATION_TIMEOUT: Final = float(os.getenv("CONVERSATION_TIMEOUT", "1800"))
+ADMIN_TOKEN: Final = os.getenv("ADMIN_TOKEN")
 
-async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+
+async def start_command(update: Update, context: SessionContext) -> None:
     if update.message is None:
         logging.warning("No message found in update; ignoring.")
         return
     
     await update.message.chat.send_action(action=ChatAction.TYPING)
 
-    initial_prompt = [
-        {"role": "user", "parts": [{"text": SYSTEM_PROMPT}]}
-    ]
-    initial_message = await get_gemini_response(initial_prompt)
+    if context.user_data is None:
+        logging.error("No user_data found in context; cannot maintain chat history.")
+        return
 
-    logging.debug(f"context: {context.user_data}   ")
+    context.user_data.clear_history()
+    initial_message = await get_gemini_response(context.user_data.history())
 
-    if context.user_data is not None:   
-        context.user_data["chat_history"] = [
-            {"role": "user", "parts": [{"text": SYSTEM_PROMPT}]},
-            {"role": "model", "parts": [{"text": initial_message}]}
-        ]
-        logging.info(f"Chat history initialized for user {update.message.from_user}")
+    context.user_data.add_turn(MODEL_ROLE, initial_message)
+    logging.info(f"Chat history initialized for user {update.message.from_user}")
 
     await update.message.reply_text(initial_message)
 
-async def clear_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+async def clear_command(update: Update, context: SessionContext) -> None:
     if update.message is None:
         logging.warning("No message found in update; ignoring.")
         return
@@ -55,15 +71,13 @@ async def clear_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     await update.message.chat.send_action(action=ChatAction.TYPING)
 
     if context.user_data is not None:
-        context.user_data["chat_history"] = [
-            {"role": "user", "parts": [{"text": SYSTEM_PROMPT}]}
-        ]
+        context.user_data.clear_history()
         logging.info(f"Chat history cleared for user {update.message.from_user}")
     
     if update.message:
         await update.message.reply_text("Chat history cleared.")
 
-async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+async def help_command(update: Update, context: SessionContext) -> None:
     if update.message is None:
         logging.warning("No message found in update; ignoring.")
         return
@@ -82,7 +96,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 
 
 
-async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+async def handle_message(update: Update, context: SessionContext) -> None:
     
     if update.message is None or update.message.text is None:
         logging.warning("No message or text found; ignoring.")
@@ -95,19 +109,12 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
     logging.info(f"Received message in {message_type}: {text}")
 
-    if context.user_data is not None and "chat_history" not in context.user_data:
-        context.user_data["chat_history"] = [
-            {"role": "user", "parts": [{"text": SYSTEM_PROMPT}]}
-        ]
-
     if context.user_data is not None:
         if message_type in ["group", "supergroup"]:
             if text and BOT_USERNAME  and BOT_USERNAME in text:
                 user_message = text.replace(f"@{BOT_USERNAME}", "").strip()
-                context.user_data["chat_history"].append(
-                    {"role": "user", "parts": [{"text": user_message}]}
-                )
-                bot_response = await get_gemini_response(context.user_data["chat_history"])
+                context.user_data.add_turn(USER_ROLE, user_message)
+                bot_response = await get_gemini_response(context.user_data.history())
                 logging.info(f"Sending response: {bot_response}")
                 for chunk in split_message(bot_response):
                     await update.message.reply_text(chunk)
@@ -116,76 +123,155 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                 return
         else:
             user_message = text.replace(f"@{BOT_USERNAME}", "").strip()
-            context.user_data["chat_history"].append(
-                    {"role": "user", "parts": [{"text": user_message}]}
-                )
-            bot_response = await get_gemini_response(context.user_data["chat_history"])
+            context.user_data.add_turn(USER_ROLE, user_message)
+            bot_response = await get_gemini_response(context.user_data.history())
             logging.info(f"Sending response: {bot_response}")
             for chunk in split_message(bot_response):
                 await update.message.reply_text(chunk)
     else:
         logging.error("No user_data found in context; cannot maintain chat history.")
 
-async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+async def touch_session(update: Update, context: SessionContext) -> None:
+    if context.user_data is not None:
+        context.user_data.touch()
+
+async def error_handler(update: object, context: SessionContext) -> None:
     logging.error(f"An error occurred: {context.error} for Update: {update}")
 
 
 
 
 
-if TOKEN is None:
-    raise ValueError("TELEGRAM_BOT_TOKEN is not set in environment variables.")
+def build_request() -> HTTPXRequest:
+    """HTTP client for Bot API calls, sharing one keep-alive connection pool."""
+    return HTTPXRequest(
+        connection_pool_size=TELEGRAM_POOL_SIZE,
+        pool_timeout=TELEGRAM_POOL_TIMEOUT,
+        httpx_kwargs={
+            "limits": httpx.Limits(
+                max_connections=TELEGRAM_POOL_SIZE,
+                max_keepalive_connections=TELEGRAM_POOL_SIZE,
+                keepalive_expiry=TELEGRAM_KEEPALIVE_EXPIRY,
+            )
+        },
+    )
+
+
+def build_application() -> Tuple[Application, List[ConversationHandler]]:
+    """
+    Build the bot Application and its handlers. Called from the lifespan rather
+    than at import time, so importing this module (tests, tooling, process pool
+    workers) stays cheap. Also returns the conversations whose state the session
+    evictor has to clear.
+    """
+    if TOKEN is None:
+        raise ValueError("TELEGRAM_BOT_TOKEN is not set in environment variables.")
+
+    if WEBHOOK_URL is None:
+        raise ValueError("WEBHOOK_URL is not set in environment variables.")
+
+    application = (
+        ApplicationBuilder()
+        .token(TOKEN)
+        .base_url(TELEGRAM_BASE_URL)
+        .request(build_request())
+        .rate_limiter(OutboundScheduler(max_retries=TELEGRAM_MAX_RETRIES))
+        .context_types(ContextTypes(user_data=Session))
+        .build()
+    )
 
-if WEBHOOK_URL is None:
-    raise ValueError("WEBHOOK_URL is not set in environment variables.")
+    image_choice_handler = CallbackQueryHandler(resume_image_choice, pattern=IMAGE_CHOICE_PATTERN)
+    caption_choice_handler = CallbackQueryHandler(resume_caption_choice, pattern=CAPTION_CHOICE_PATTERN)
+
+    create_post_conv = ConversationHandler(
+        # The choice handlers are also entry points so a post whose images or
+        # captions were delivered by the job queue after a restart can be resumed
+        entry_points=[CommandHandler("create_post", create_post_command), image_choice_handler, caption_choice_handler],
+        states={
+            ASK_IMAGE: [MessageHandler(filters.PHOTO, ask_description)],
+            ASK_DESCRIPTION: [MessageHandler(filters.TEXT & ~filters.COMMAND, generate_post)],
+            CHOOSE_IMAGE: [image_choice_handler],
+            CHOOSE_CAPTION: [caption_choice_handler],
+            ConversationHandler.TIMEOUT: [TypeHandler(Update, timeout)]
+        },
+        fallbacks=[CommandHandler("cancel", cancel)],
+        allow_reentry=True,
+        conversation_timeout=CONVERSATION_TIMEOUT
+    )
 
-app = ApplicationBuilder().token(TOKEN).build()
+    application.add_handler(TypeHandler(Update, touch_session), group=-1)
+    application.add_handler(CommandHandler("start", start_command))
+    application.add_handler(CommandHandler("clear", clear_command))
+    application.add_handler(CommandHandler("help", help_command))
+    application.add_handler(create_post_conv)
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
 
-create_post_conv = ConversationHandler(
-    entry_points=[CommandHandler("create_post", create_post_command)],
-    states={
-        ASK_IMAGE: [MessageHandler(filters.PHOTO, ask_description)],
-        ASK_DESCRIPTION: [MessageHandler(filters.TEXT & ~filters.COMMAND, generate_post)],
-        CHOOSE_IMAGE: [
-            CallbackQueryHandler(handle_image_navigation, pattern='^(prev_image|next_image|select_image|regenerate_images|cancel_post)$')
-        ],
-        CHOOSE_CAPTION: [
-            CallbackQueryHandler(handle_caption_choice, pattern='^caption_[0-2]$'),
-            CallbackQueryHandler(generate_post, pattern='^regenerate_captions$'),
-            CallbackQueryHandler(cancel, pattern='^cancel_post$')
-        ]
-    },
-    fallbacks=[CommandHandler("cancel", cancel)],
-    allow_reentry=True
-)
+    application.add_error_handler(error_handler)
 
-app.add_handler(CommandHandler("start", start_command))
-app.add_handler(CommandHandler("clear", clear_command))
-app.add_handler(CommandHandler("help", help_command))
-app.add_handler(create_post_conv)
-app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    logging.info("Bot is starting...")
+    # application.run_polling(poll_interval=3, allowed_updates=Update.ALL_TYPES)
+    return application, [create_post_conv]
 
-app.add_error_handler(error_handler)
 
-logging.info("Bot is starting...")
-logging.info("Polling...")
-# app.run_polling(poll_interval=3, allowed_updates=Update.ALL_TYPES)
+# Built by the lifespan
+app: Optional[Application] = None
 
 
 @asynccontextmanager
-async def lifespan(app: FastAPI):
+async def lifespan(server: FastAPI):
     # Startup logic
-    await set_bot_webhook()
+    global app, event_loop_thread_id
+    event_loop_thread_id = threading.get_ident()
+    app, conversations = build_application()
+    await app.initialize()
+    # Starts the JobQueue, which ConversationHandler needs for conversation_timeout
+    await app.start()
+    start_export_pool()
+    prewarm_task = asyncio.create_task(prewarm_connections())
+    job_worker = JobWorker(job_queue, app.bot, deliver_job_result)
+    job_worker_task = asyncio.create_task(job_worker.run())
+    evictor_task = asyncio.create_task(run_session_evictor(app, conversations))
+    await set_bot_webhook(app)
     yield
+    # Shutdown logic
+    prewarm_task.cancel()
+    job_worker_task.cancel()
+    evictor_task.cancel()
+    await job_worker.stop()
+    shutdown_export_pool()
+    await app.stop()
+    await app.shutdown()
+    await asyncio.to_thread(flush_traces)
     
 
 server = FastAPI(lifespan=lifespan)
 
-async def set_bot_webhook():
-    await app.initialize()
-    await app.bot.set_webhook(WEBHOOK_URL)
+event_loop_thread_id: int = threading.get_ident()
+
+async def set_bot_webhook(application: Application):
+    """
+    Register the webhook only when Telegram doesn't already point at WEBHOOK_URL,
+    so worker restarts don't re-issue setWebhook on every boot.
+    """
+    webhook_info = await application.bot.get_webhook_info()
+    if webhook_info.url == WEBHOOK_URL:
+        logging.info(f"Webhook already set to {WEBHOOK_URL}")
+        return
+
+    await application.bot.set_webhook(WEBHOOK_URL)
     logging.info(f"Webhook set to {WEBHOOK_URL}")
 
+async def prewarm_connections():
+    """
+    Build the Gemini client and open its connection in the background,
+    so the first update doesn't pay for it.
+    """
+    try:
+        await prewarm()
+        logging.info("Gemini client prewarmed")
+    except Exception as e:
+        logging.warning(f"Prewarm failed: {e}")
+
 @server.get("/")
 async def root():
     return {"message": "Bot is running"}
@@ -196,7 +282,24 @@ async def health_check():
 
 @server.post("/webhook")
 async def webhook(request: Request):
+    if app is None:
+        raise HTTPException(status_code=503, detail="Bot is starting")
     data = await request.json()
     update = Update.de_json(data, app.bot)
-    await app.process_update(update)
+    with trace("webhook", update_id=update.update_id):
+        await app.process_update(update)
     return {"ok": True}
+
+@server.get("/admin/profile", response_class=PlainTextResponse)
+async def profile(seconds: float = 10.0, interval: float = 0.005, x_admin_token: str | None = Header(default=None)):
+    """
+    Sample the event loop thread for `seconds` and return folded stacks.
+    Disabled unless ADMIN_TOKEN is set; callers must send it as X-Admin-Token.
+    """
+    if not ADMIN_TOKEN or x_admin_token is None or not secrets.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+    try:
+        return await asyncio.to_thread(sample_profile, event_loop_thread_id, seconds, interval)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
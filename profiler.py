@@ -0,0 +1,56 @@
+from typing import Final
+import setup_logging
+import logging
+
+import sys
+import threading
+import time
+from collections import Counter
+
+MAX_PROFILE_SECONDS: Final[float] = 60.0
+MIN_INTERVAL_SECONDS: Final[float] = 0.001
+
+_profile_lock = threading.Lock()
+
+
+def _folded_stack(frame) -> str:
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({code.co_filename}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def sample_profile(thread_id: int, seconds: float, interval: float = 0.005) -> str:
+    """
+    Sample the stack of `thread_id` every `interval` seconds for `seconds`
+    and return it in folded-stack format (one `stack count` line per unique
+    stack), ready for flamegraph.pl or speedscope.
+
+    Blocking; run it from a different thread than the one being sampled.
+    Raises RuntimeError if another profile is already running.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        raise RuntimeError("A profile is already being captured.")
+
+    try:
+        return _sample(thread_id, seconds, interval)
+    finally:
+        _profile_lock.release()
+
+
+def _sample(thread_id: int, seconds: float, interval: float) -> str:
+    seconds = min(max(seconds, 0.0), MAX_PROFILE_SECONDS)
+    interval = max(interval, MIN_INTERVAL_SECONDS)
+
+    counts: Counter = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        frame = sys._current_frames().get(thread_id)
+        if frame is not None:
+            counts[_folded_stack(frame)] += 1
+        time.sleep(interval)
+
+    logging.info(f"Captured {sum(counts.values())} profile samples over {seconds}s")
+    return "\n".join(f"{stack} {count}" for stack, count in counts.most_common())
@@ -0,0 +1,231 @@
+from typing import Any, Callable, Coroutine, Dict, Final, List, Optional, Tuple, Union
+import setup_logging
+import logging
+
+import asyncio
+import heapq
+import itertools
+import time
+from datetime import timedelta
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+# Telegram's documented limits: ~30 messages/second overall, ~1 message/second
+# per chat and ~20 messages/minute per group.
+GLOBAL_RATE: Final[float] = 30.0
+CHAT_RATE: Final[float] = 1.0
+GROUP_RATE: Final[float] = 20 / 60
+
+# Endpoints the user is actively waiting on; they jump ahead of bulk sends.
+INTERACTIVE_ENDPOINTS: Final = frozenset({
+    "answerCallbackQuery",
+    "editMessageMedia",
+    "editMessageText",
+    "editMessageCaption",
+    "editMessageReplyMarkup",
+    "sendChatAction",
+})
+
+# Endpoints that don't post into a chat and are not counted against any bucket.
+UNLIMITED_ENDPOINTS: Final = frozenset({
+    "getMe",
+    "getFile",
+    "getUpdates",
+    "getWebhookInfo",
+    "setWebhook",
+    "deleteWebhook",
+    "close",
+    "logOut",
+})
+
+MAX_CHAT_BUCKETS: Final[int] = 10_000
+
+
+# Waiters with a lower value are served first
+INTERACTIVE_PRIORITY: Final[int] = 0
+BULK_PRIORITY: Final[int] = 1
+
+
+class TokenBucket:
+    """
+    Token bucket: `rate` tokens per second, holding at most `capacity`.
+
+    Waiters are served by priority and then in arrival order. Only the waiter
+    at the head of the queue sleeps until the next token; the rest wait to be
+    woken, so a higher-priority arrival overtakes everything already queued.
+    """
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._waiters: List[Tuple[int, int, asyncio.Event]] = []
+        self._sequence = itertools.count()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        if now < self.updated:  # still paused
+            return
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def is_full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity and not self._waiters
+
+    def _wake_head(self) -> None:
+        if self._waiters:
+            self._waiters[0][2].set()
+
+    def pause(self, seconds: float) -> None:
+        """Hand out no tokens for `seconds`, then restart from an empty bucket."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+        self.updated = self.paused_until
+        self._wake_head()
+
+    async def wait_until_resumed(self) -> None:
+        """Wait out a pause without taking a token."""
+        while True:
+            remaining = self.paused_until - time.monotonic()
+            if remaining <= 0:
+                return
+            await asyncio.sleep(remaining)
+
+    def _delay(self) -> float:
+        now = time.monotonic()
+        if now < self.paused_until:
+            return self.paused_until - now
+        self._refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    async def acquire(self, priority: int = BULK_PRIORITY) -> None:
+        entry = (priority, next(self._sequence), asyncio.Event())
+        heapq.heappush(self._waiters, entry)
+        wakeup = entry[2]
+        try:
+            while True:
+                wakeup.clear()
+                if self._waiters[0] is not entry:
+                    await wakeup.wait()
+                    continue
+                delay = self._delay()
+                if delay <= 0:
+                    heapq.heappop(self._waiters)
+                    self.tokens -= 1
+                    self._wake_head()
+                    return
+                try:
+                    await asyncio.wait_for(wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            if entry in self._waiters:
+                was_head = self._waiters[0] is entry
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                if was_head:
+                    self._wake_head()
+            raise
+
+
+class OutboundScheduler(BaseRateLimiter[int]):
+    """
+    Rate limiter for every outbound Bot API call made by the Application.
+
+    Requests pass a per-chat bucket and then a shared global bucket. Interactive
+    calls (edits, callback answers, chat actions) are served ahead of queued
+    bulk sends by the global bucket. A RetryAfter response pauses the chat's
+    bucket (or the global one for calls without a chat) for the requested time
+    and the request is retried instead of being surfaced as an error.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = GLOBAL_RATE,
+        global_burst: float = 1,
+        chat_rate: float = CHAT_RATE,
+        group_rate: float = GROUP_RATE,
+        chat_burst: float = 3,
+        max_retries: int = 3,
+    ) -> None:
+        # A full bucket of `global_rate` tokens would let up to twice the rate
+        # out in the first second, which Telegram answers with 429s
+        self._global_bucket = TokenBucket(global_rate, global_burst)
+        self._chat_rate = chat_rate
+        self._group_rate = group_rate
+        self._chat_burst = chat_burst
+        self._max_retries = max_retries
+        self._chat_buckets: Dict[Union[int, str], TokenBucket] = {}
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        self._chat_buckets.clear()
+
+    def _chat_bucket(self, chat_id: Union[int, str]) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= MAX_CHAT_BUCKETS:
+                # Buckets that have refilled completely carry no state worth keeping
+                self._chat_buckets = {
+                    key: value for key, value in self._chat_buckets.items() if not value.is_full()
+                }
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            rate = self._group_rate if is_group else self._chat_rate
+            bucket = TokenBucket(rate, self._chat_burst)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Union[bool, Dict[str, Any], list]]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[int],
+    ) -> Union[bool, Dict[str, Any], list]:
+        if endpoint in UNLIMITED_ENDPOINTS:
+            return await callback(*args, **kwargs)
+
+        interactive = endpoint in INTERACTIVE_ENDPOINTS
+        chat_id = data.get("chat_id")
+        max_retries = self._max_retries if rate_limit_args is None else rate_limit_args
+
+        attempt = 0
+        while True:
+            if chat_id is not None:
+                chat_bucket = self._chat_bucket(chat_id)
+                if interactive:
+                    # Not rate limited per chat, but a chat that got a 429 is off limits
+                    await chat_bucket.wait_until_resumed()
+                else:
+                    await chat_bucket.acquire()
+            await self._global_bucket.acquire(INTERACTIVE_PRIORITY if interactive else BULK_PRIORITY)
+
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                attempt += 1
+                if attempt > max_retries:
+                    raise
+                retry_after = e.retry_after
+                delay = retry_after.total_seconds() if isinstance(retry_after, timedelta) else float(retry_after)
+                logging.warning(
+                    f"Flood limit hit on {endpoint} for chat {chat_id}; "
+                    f"pausing {'that chat' if chat_id is not None else 'all sends'} for {delay}s "
+                    f"(attempt {attempt}/{max_retries})"
+                )
+                # Hold everything queued behind the same limit rather than only
+                # retrying this request into the same wall. A 429 on a chat is
+                # usually its per-chat or group limit, which can be tens of
+                # seconds and must not stall other users' chats.
+                if chat_id is not None:
+                    self._chat_bucket(chat_id).pause(delay + 0.1)
+                else:
+                    self._global_bucket.pause(delay + 0.1)
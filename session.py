@@ -0,0 +1,164 @@
+from typing import Any, Dict, Final, List, Optional, Sequence
+import setup_logging
+import logging
+
+import os
+import sys
+import time
+import heapq
+import asyncio
+
+from telegram.ext import Application, CallbackContext, ConversationHandler, ExtBot
+
+from gemini import Caption, Image, SYSTEM_PROMPT
+
+# Role strings are interned so every turn in every session shares one object
+USER_ROLE: Final = sys.intern("user")
+MODEL_ROLE: Final = sys.intern("model")
+
+MAX_HISTORY_TURNS: Final = int(os.getenv("MAX_HISTORY_TURNS", "40"))
+SESSION_TTL_SECONDS: Final = float(os.getenv("SESSION_TTL_SECONDS", str(24 * 60 * 60)))
+SESSION_MAX_COUNT: Final = int(os.getenv("SESSION_MAX_COUNT", "50000"))
+SESSION_EVICT_INTERVAL: Final = float(os.getenv("SESSION_EVICT_INTERVAL", "300"))
+
+
+class Session:
+    """
+    Per-user state, used as `context.user_data` in place of a free-form dict.
+
+    Chat history is stored flat as parallel role/text lists; the system prompt is
+    shared rather than copied into every session and is only added back when the
+    history is turned into Gemini contents.
+    """
+
+    __slots__ = (
+        "roles",
+        "texts",
+        "product_image",
+        "description",
+        "generated_images",
+        "current_image_index",
+        "images_job_id",
+        "selected_image",
+        "captions",
+        "captions_job_id",
+        "last_seen",
+    )
+
+    def __init__(self) -> None:
+        self.roles: List[str] = []
+        self.texts: List[str] = []
+        self.product_image: Optional[str] = None
+        self.description: Optional[str] = None
+        self.generated_images: Optional[List[Image]] = None
+        self.current_image_index: int = 0
+        self.images_job_id: Optional[int] = None
+        self.selected_image: Optional[Image] = None
+        self.captions: Optional[List[Caption]] = None
+        self.captions_job_id: Optional[int] = None
+        self.last_seen: float = time.monotonic()
+
+    def touch(self) -> None:
+        self.last_seen = time.monotonic()
+
+    def add_turn(self, role: str, text: str) -> None:
+        self.roles.append(MODEL_ROLE if role == MODEL_ROLE else USER_ROLE)
+        self.texts.append(text)
+        if len(self.texts) > MAX_HISTORY_TURNS:
+            del self.roles[0]
+            del self.texts[0]
+
+    def clear_history(self) -> None:
+        self.roles.clear()
+        self.texts.clear()
+
+    def history(self) -> List[Dict[str, Any]]:
+        """Chat history in the Gemini `contents` format, starting with the system prompt."""
+        contents: List[Dict[str, Any]] = [{"role": USER_ROLE, "parts": [{"text": SYSTEM_PROMPT}]}]
+        contents.extend(
+            {"role": role, "parts": [{"text": text}]}
+            for role, text in zip(self.roles, self.texts)
+        )
+        return contents
+
+    def clear_post(self) -> None:
+        """Forget the /create_post flow in progress."""
+        self.product_image = None
+        self.description = None
+        self.generated_images = None
+        self.current_image_index = 0
+        self.images_job_id = None
+        self.selected_image = None
+        self.captions = None
+        self.captions_job_id = None
+
+
+SessionContext = CallbackContext[ExtBot, Session, dict, dict]
+
+
+async def _drop_conversations(conversation: ConversationHandler, user_ids: set) -> None:
+    """
+    Forget the conversation state (and pending timeout) of the given users.
+    ConversationHandler has no public API for dropping a conversation, so its
+    `_conversations` map is edited directly; keys are (chat_id, user_id) with
+    the default per_chat/per_user settings. The timeout jobs lock is the one
+    ConversationHandler takes before firing or replacing a timeout.
+
+    Relies on private attributes as of python-telegram-bot 22.3 (pinned in
+    requirements.txt); re-check them when upgrading.
+    """
+    async with conversation._timeout_jobs_lock:
+        for key in [key for key in conversation._conversations if len(key) > 1 and key[1] in user_ids]:
+            del conversation._conversations[key]
+            timeout_job = conversation.timeout_jobs.pop(key, None)
+            if timeout_job is not None:
+                timeout_job.schedule_removal()
+
+
+async def evict_idle_sessions(
+    application: Application,
+    conversations: Sequence[ConversationHandler] = (),
+    ttl: float = SESSION_TTL_SECONDS,
+    max_count: int = SESSION_MAX_COUNT,
+) -> int:
+    """
+    Drop sessions idle for longer than `ttl`, then the least recently seen ones
+    until at most `max_count` remain, along with the users' state in
+    `conversations`. Returns the number of sessions dropped.
+
+    The ceiling is a session count, not a byte budget; see
+    benchmarks/session_memory.py for bytes per session.
+
+    Dropping is safe: generation results live in the job queue and are loaded
+    back when the user presses a button on an old post.
+    """
+    now = time.monotonic()
+    expired = [user_id for user_id, session in application.user_data.items() if now - session.last_seen > ttl]
+    overflow = len(application.user_data) - len(expired) - max_count
+    if overflow > 0:
+        expired_ids = set(expired)
+        live = ((user_id, session) for user_id, session in application.user_data.items() if user_id not in expired_ids)
+        expired.extend(user_id for user_id, _ in heapq.nsmallest(overflow, live, key=lambda item: item[1].last_seen))
+
+    for user_id in expired:
+        application.drop_user_data(user_id)
+    if expired:
+        for conversation in conversations:
+            await _drop_conversations(conversation, set(expired))
+
+    if expired:
+        logging.info(f"Evicted {len(expired)} idle sessions; {len(application.user_data)} remain")
+    return len(expired)
+
+
+async def run_session_evictor(
+    application: Application,
+    conversations: Sequence[ConversationHandler] = (),
+    interval: float = SESSION_EVICT_INTERVAL,
+) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await evict_idle_sessions(application, conversations)
+        except Exception as e:
+            logging.error(f"Error evicting sessions: {e}")
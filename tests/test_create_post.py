@@ -0,0 +1,109 @@
+import asyncio
+import re
+from types import SimpleNamespace
+
+import pytest
+from telegram.ext import ConversationHandler
+
+import create_post
+from create_post import CHOOSE_IMAGE, CAPTION_CHOICE_PATTERN, IMAGE_CHOICE_PATTERN
+from jobs import JobQueue
+from session import Session
+
+IMAGES = "generate_marketing_images"
+USER_ID = 2
+
+
+class FakeBot:
+    def __init__(self):
+        self.edits = []
+        self.messages = []
+
+    async def edit_message_media(self, chat_id, message_id, media, reply_markup):
+        self.edits.append(reply_markup)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.messages.append(text)
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    queue = JobQueue(str(tmp_path / "jobs.db"))
+    monkeypatch.setattr(create_post, "job_queue", queue)
+    return queue
+
+
+def finished_image_job(queue, tmp_path, name, user_id=USER_ID):
+    images = []
+    for i in range(2):
+        path = tmp_path / f"{name}_{i}.jpeg"
+        path.write_bytes(b"jpeg")
+        images.append({"fileName": path.name, "filePath": str(path)})
+    job_id = queue.submit(IMAGES, {"image_path": f"{name}.jpg", "description": name}, chat_id=1, user_id=user_id)
+    queue.claim("w")
+    queue.save_result(job_id, "w", {"images": images, "error": None})
+    queue.complete(job_id, "w")
+    return job_id
+
+
+def press(data, user_data, bot):
+    async def answer(*args, **kwargs):
+        pass
+
+    query = SimpleNamespace(
+        data=data,
+        answer=answer,
+        message=SimpleNamespace(chat=SimpleNamespace(id=1), message_id=9),
+        from_user=SimpleNamespace(id=USER_ID),
+    )
+    update = SimpleNamespace(callback_query=query, effective_user=query.from_user, message=None, update_id=1)
+    return update, SimpleNamespace(user_data=user_data, bot=bot)
+
+
+def test_buttons_on_an_older_message_show_that_messages_job(queue, tmp_path, monkeypatch):
+    old_job = finished_image_job(queue, tmp_path, "old")
+    new_job = finished_image_job(queue, tmp_path, "new")
+    session, bot = Session(), FakeBot()
+
+    state = asyncio.run(create_post.resume_image_choice(*press(f"next_image:{old_job}", session, bot)))
+    assert state == CHOOSE_IMAGE
+    assert session.images_job_id == old_job != new_job
+    assert session.description == "old"
+    assert session.current_image_index == 1
+    buttons = [button.callback_data for row in bot.edits[-1].inline_keyboard for button in row]
+    assert f"prev_image:{old_job}" in buttons
+
+    # The session already holds this job, so further presses don't touch the queue
+    monkeypatch.setattr(queue, "get_result", None)
+    asyncio.run(create_post.resume_image_choice(*press(f"prev_image:{old_job}", session, bot)))
+    assert session.current_image_index == 0
+
+
+def test_another_users_job_is_not_loaded(queue, tmp_path):
+    job_id = finished_image_job(queue, tmp_path, "theirs", user_id=99)
+    session = Session()
+
+    state = asyncio.run(create_post.resume_image_choice(*press(f"next_image:{job_id}", session, FakeBot())))
+    assert state == ConversationHandler.END
+    assert session.generated_images is None
+
+
+def test_generate_captions_without_selected_image_asks_to_restart(queue):
+    session, bot = Session(), FakeBot()
+
+    state = asyncio.run(create_post.generate_captions(*press("regenerate_captions:1", session, bot)))
+    assert state == ConversationHandler.END
+    assert bot.messages == ["Missing product image, please restart with /create_post."]
+    assert queue.claim("w") is None
+
+
+@pytest.mark.parametrize("data", ["next_image:12", "prev_image", "select_image:3", "cancel_post"])
+def test_image_pattern_accepts_buttons_with_and_without_job_id(data):
+    assert re.match(IMAGE_CHOICE_PATTERN, data)
+    assert not re.match(CAPTION_CHOICE_PATTERN, data)
+
+
+@pytest.mark.parametrize("data", ["caption_0:12", "caption_2", "regenerate_captions:4"])
+def test_caption_pattern_accepts_buttons_with_and_without_job_id(data):
+    assert re.match(CAPTION_CHOICE_PATTERN, data)
+    assert not re.match(IMAGE_CHOICE_PATTERN, data)
@@ -0,0 +1,63 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+PIL = pytest.importorskip("PIL")
+from PIL import Image, ImageDraw
+
+from export import EXPORT_FORMATS, export_post_image, shutdown_export_pool, start_export_pool
+
+
+@pytest.fixture
+def product_image(tmp_path):
+    path = tmp_path / "product.jpg"
+    img = Image.new("RGB", (1600, 1200), (230, 230, 230))
+    ImageDraw.Draw(img).ellipse((1100, 300, 1500, 900), fill=(180, 30, 40), outline=(0, 0, 0), width=10)
+    img.save(path, format="JPEG")
+    return str(path)
+
+
+def test_exports_every_format_within_budget_on_the_pool(product_image, tmp_path):
+    output_dir = tmp_path / "exports"
+    start_export_pool()
+    try:
+        response = asyncio.run(export_post_image(product_image, str(output_dir)))
+    finally:
+        shutdown_export_pool()
+
+    assert response["error"] is None
+    assert [export["name"] for export in response["exports"]] == list(EXPORT_FORMATS)
+    for export in response["exports"]:
+        spec = EXPORT_FORMATS[export["name"]]
+        with Image.open(export["filePath"]) as exported:
+            assert exported.size == (spec["width"], spec["height"])
+            assert exported.format == spec["format"]
+        assert export["bytes"] <= spec["maxBytes"]
+    assert sorted(path.name for path in output_dir.iterdir()) == sorted(e["fileName"] for e in response["exports"])
+
+
+def test_send_exports_removes_variant_files_after_upload(product_image, tmp_path, monkeypatch):
+    import create_post
+    from export import export_post_image as real_export
+
+    output_dir = tmp_path / "exports"
+    uploaded = []
+
+    class FakeBot:
+        async def send_chat_action(self, chat_id, action):
+            pass
+
+        async def send_media_group(self, chat_id, media):
+            uploaded.extend(media)
+
+    monkeypatch.setattr(create_post, "export_post_image", lambda path: real_export(path, str(output_dir)))
+    context = SimpleNamespace(bot=FakeBot())
+    start_export_pool()
+    try:
+        asyncio.run(create_post.send_exports(context, 1, product_image))
+    finally:
+        shutdown_export_pool()
+
+    assert len(uploaded) == len(EXPORT_FORMATS)
+    assert list(output_dir.iterdir()) == []
@@ -0,0 +1,199 @@
+import asyncio
+import time
+from contextlib import closing
+
+import pytest
+
+import jobs
+from jobs import DONE, FAILED, PENDING, RUNNING, JobQueue, JobWorker
+
+KIND = "generate_marketing_images"
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(str(tmp_path / "jobs.db"))
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    """Replace the image handler with a fast fake that records its calls."""
+    calls = []
+
+    async def fake_handler(image_path, description):
+        calls.append(image_path)
+        return {"images": [{"fileName": "a.jpeg", "filePath": image_path}], "error": None}
+
+    monkeypatch.setitem(jobs.JOB_HANDLERS, KIND, fake_handler)
+    return calls
+
+
+def submit(queue, image_path="x.jpg", **kwargs):
+    return queue.submit(KIND, {"image_path": image_path, "description": "d"}, chat_id=1, user_id=2, **kwargs)
+
+
+def status(queue, job_id):
+    with closing(queue._connect()) as conn:
+        return conn.execute("SELECT status, attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()
+
+
+async def run_worker_until(worker, done, timeout=10.0):
+    task = asyncio.create_task(worker.run())
+    deadline = time.monotonic() + timeout
+    try:
+        while not done():
+            assert time.monotonic() < deadline, "worker did not finish in time"
+            await asyncio.sleep(0.01)
+    finally:
+        task.cancel()
+        await worker.stop()
+
+
+def test_submit_claim_complete(queue):
+    job_id = submit(queue, update_id=42)
+
+    job = queue.claim("w1")
+    assert job["id"] == job_id
+    assert job["update_id"] == 42
+    assert job["status"] == RUNNING
+    assert job["attempts"] == 1
+    assert queue.claim("w2") is None
+
+    assert queue.save_result(job_id, "w1", {"images": [], "error": None})
+    assert queue.complete(job_id, "w1")
+    assert tuple(status(queue, job_id)) == (DONE, 1)
+    assert queue.get_result(job_id, 2, KIND)["id"] == job_id
+    assert queue.get_result(job_id, 3, KIND) is None
+    assert queue.get_result(job_id, 2, "generate_marketing_captions") is None
+
+
+def test_expired_lease_is_reclaimed_and_old_owner_is_fenced(queue):
+    job_id = submit(queue)
+    queue.claim("w1", lease_seconds=0.05)
+    time.sleep(0.1)
+
+    job = queue.claim("w2")
+    assert job["id"] == job_id
+    assert job["attempts"] == 2
+
+    # The first worker finishing late must not overwrite or complete the job
+    assert not queue.save_result(job_id, "w1", {"images": [], "error": None})
+    assert not queue.complete(job_id, "w1")
+    assert queue.fail(job, "w1", "late failure")
+    assert tuple(status(queue, job_id)) == (RUNNING, 2)
+
+
+def test_fail_backs_off_then_fails_after_max_attempts(queue):
+    job_id = submit(queue, max_attempts=2)
+
+    job = queue.claim("w1")
+    assert queue.fail(job, "w1", "503", backoff=0.1)
+    assert tuple(status(queue, job_id)) == (PENDING, 1)
+    assert queue.claim("w1") is None  # still backing off
+
+    time.sleep(0.15)
+    job = queue.claim("w1")
+    assert job["attempts"] == 2
+    assert not queue.fail(job, "w1", "503", backoff=0.1)
+    assert tuple(status(queue, job_id)) == (FAILED, 2)
+    assert queue.claim("w1") is None
+
+
+def test_release_on_cancel_returns_job_without_counting_attempt(queue, monkeypatch):
+    started = asyncio.Event()
+
+    async def hanging_handler(image_path, description):
+        started.set()
+        await asyncio.sleep(3600)
+
+    monkeypatch.setitem(jobs.JOB_HANDLERS, KIND, hanging_handler)
+    job_id = submit(queue)
+
+    async def scenario():
+        worker = JobWorker(queue, None, lambda bot, job: asyncio.sleep(0), poll_interval=0.01)
+        task = asyncio.create_task(worker.run())
+        await asyncio.wait_for(started.wait(), 5)
+        task.cancel()
+        await worker.stop()
+
+    asyncio.run(scenario())
+    assert tuple(status(queue, job_id)) == (PENDING, 0)
+
+
+def test_saved_result_is_redelivered_without_rerunning(queue, calls):
+    job_id = submit(queue)
+    queue.claim("dead", lease_seconds=0.05)
+    assert queue.save_result(job_id, "dead", {"images": [{"fileName": "a", "filePath": "a"}], "error": None})
+    time.sleep(0.1)
+
+    delivered = []
+
+    async def deliver(bot, job):
+        delivered.append(job)
+
+    worker = JobWorker(queue, None, deliver, poll_interval=0.01)
+    asyncio.run(run_worker_until(worker, lambda: delivered))
+
+    assert calls == []
+    assert [job["id"] for job in delivered] == [job_id]
+    assert tuple(status(queue, job_id)) == (DONE, 2)
+
+
+def test_lease_is_renewed_while_a_slow_job_runs(queue, monkeypatch):
+    async def slow_handler(image_path, description):
+        await asyncio.sleep(1.5)
+        return {"images": [{"fileName": "a", "filePath": image_path}], "error": None}
+
+    monkeypatch.setitem(jobs.JOB_HANDLERS, KIND, slow_handler)
+    job_id = submit(queue)
+    delivered = []
+    stolen = []
+
+    async def deliver(bot, job):
+        delivered.append(job)
+
+    async def scenario():
+        worker = JobWorker(queue, None, deliver, lease_seconds=0.5, poll_interval=0.01)
+        task = asyncio.create_task(worker.run())
+        while status(queue, job_id)["status"] != RUNNING:
+            await asyncio.sleep(0.01)
+        while not delivered:
+            job = await asyncio.to_thread(queue.claim, "other", 0.5)
+            if job is not None:
+                stolen.append(job)
+            await asyncio.sleep(0.02)
+        task.cancel()
+        await worker.stop()
+
+    asyncio.run(asyncio.wait_for(scenario(), 10))
+    assert stolen == []
+    assert len(delivered) == 1
+    assert tuple(status(queue, job_id)) == (DONE, 1)
+
+
+def test_throughput_and_recovery_time(queue, calls):
+    count = 200
+    for i in range(count):
+        submit(queue, image_path=f"{i}.jpg")
+    delivered = []
+
+    async def deliver(bot, job):
+        delivered.append(job["id"])
+
+    worker = JobWorker(queue, None, deliver, concurrency=8, poll_interval=0.01)
+    started = time.perf_counter()
+    asyncio.run(run_worker_until(worker, lambda: len(delivered) == count, timeout=60))
+    elapsed = time.perf_counter() - started
+    print(f"\njob throughput: {count / elapsed:.0f} jobs/s ({count} jobs in {elapsed:.2f}s)")
+    assert len(set(delivered)) == count
+
+    # A worker dies holding a job; another worker must pick it up once the lease expires
+    lease = 0.3
+    job_id = submit(queue, image_path="orphan.jpg")
+    queue.claim("dead", lease_seconds=lease)
+    crashed_at = time.perf_counter()
+    worker = JobWorker(queue, None, deliver, poll_interval=0.01)
+    asyncio.run(run_worker_until(worker, lambda: job_id in delivered))
+    recovery = time.perf_counter() - crashed_at
+    print(f"job recovery time: {recovery:.2f}s with a {lease}s lease")
+    assert recovery < lease + 1.0
@@ -0,0 +1,187 @@
+import asyncio
+import time
+from datetime import timedelta
+
+import pytest
+from telegram.error import RetryAfter
+
+from rate_limiter import INTERACTIVE_PRIORITY, OutboundScheduler, TokenBucket
+
+
+def send(scheduler, endpoint, chat_id, callback):
+    return scheduler.process_request(callback, (), {}, endpoint, {"chat_id": chat_id}, None)
+
+
+def test_bucket_enforces_rate_after_burst():
+    async def scenario():
+        bucket = TokenBucket(rate=50, capacity=5)
+        started = time.monotonic()
+        for _ in range(15):
+            await bucket.acquire()
+        return time.monotonic() - started
+
+    elapsed = asyncio.run(scenario())
+    # 5 tokens up front, then 10 more at 50/s
+    assert 0.18 <= elapsed < 0.5
+
+
+def test_interactive_waiter_overtakes_queued_bulk_waiters():
+    async def scenario():
+        bucket = TokenBucket(rate=20, capacity=1)
+        order = []
+
+        async def take(name, priority):
+            await bucket.acquire(priority)
+            order.append(name)
+
+        bulk = [asyncio.create_task(take(f"bulk{i}", 1)) for i in range(5)]
+        await asyncio.sleep(0.01)
+        edit = asyncio.create_task(take("edit", INTERACTIVE_PRIORITY))
+        await asyncio.gather(edit, *bulk)
+        return order
+
+    order = asyncio.run(scenario())
+    assert order[0] == "bulk0"
+    assert order.index("edit") == 1
+
+
+def test_cancelled_head_waiter_does_not_stall_the_queue():
+    async def scenario():
+        bucket = TokenBucket(rate=20, capacity=1)
+        await bucket.acquire()
+        head = asyncio.create_task(bucket.acquire())
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(bucket.acquire())
+        await asyncio.sleep(0)
+        head.cancel()
+        await asyncio.wait_for(follower, 1)
+
+    asyncio.run(scenario())
+
+
+def test_edit_is_not_sent_after_a_burst_of_bulk_sends():
+    async def scenario():
+        scheduler = OutboundScheduler(global_rate=5, global_burst=5, chat_rate=100, chat_burst=100)
+        order = []
+
+        def callback(name):
+            async def call():
+                order.append(name)
+                return True
+            return call
+
+        bulk = [
+            asyncio.create_task(send(scheduler, "sendPhoto", 1000 + i, callback(f"bulk{i}")))
+            for i in range(12)
+        ]
+        await asyncio.sleep(0.05)
+        edit = asyncio.create_task(send(scheduler, "editMessageText", 1, callback("edit")))
+        await asyncio.gather(edit, *bulk)
+        return order
+
+    order = asyncio.run(scenario())
+    # The first five go out on the initial burst; the edit takes the next token
+    assert order.index("edit") == 5
+
+
+def rate_limited_once(sent, limited, pause):
+    """Callback factory whose first call overall gets a RetryAfter."""
+    def callback(name):
+        async def call():
+            if not limited:
+                limited.append(time.monotonic())
+                raise RetryAfter(timedelta(seconds=pause))
+            sent[name] = time.monotonic()
+            return True
+        return call
+    return callback
+
+
+def test_retry_after_pauses_the_limited_chat_only():
+    pause = 0.3
+
+    async def scenario():
+        scheduler = OutboundScheduler(global_rate=100, global_burst=100, chat_rate=100, chat_burst=100)
+        sent, limited = {}, []
+        callback = rate_limited_once(sent, limited, pause)
+
+        first = asyncio.create_task(send(scheduler, "sendMessage", 1, callback("first")))
+        await asyncio.sleep(0.01)
+        same_chat = [send(scheduler, "sendMessage", 1, callback(f"same{i}")) for i in range(5)]
+        other_chats = [send(scheduler, "sendMessage", 2 + i, callback(f"other{i}")) for i in range(20)]
+        await asyncio.gather(first, *same_chat, *other_chats)
+        return limited[0], sent
+
+    limited_at, sent = asyncio.run(scenario())
+    assert len(sent) == 26
+    same_chat = [at for name, at in sent.items() if not name.startswith("other")]
+    other_chats = [at for name, at in sent.items() if name.startswith("other")]
+    assert min(same_chat) - limited_at >= pause
+    assert max(other_chats) - limited_at < pause / 2
+    recovery = max(same_chat) - limited_at
+    print(f"\n429 recovery: limited chat drained {recovery:.2f}s after a {pause}s RetryAfter")
+    assert recovery < pause + 0.5
+
+
+def test_another_chats_edit_is_not_delayed_by_a_429():
+    pause = 1.0
+
+    async def scenario():
+        scheduler = OutboundScheduler()
+        sent, limited = {}, []
+        callback = rate_limited_once(sent, limited, pause)
+
+        first = asyncio.create_task(send(scheduler, "sendMessage", -100, callback("group")))
+        await asyncio.sleep(0.01)
+        await send(scheduler, "editMessageText", 7, callback("edit"))
+        edited_after = time.monotonic() - limited[0]
+        first.cancel()
+        return edited_after
+
+    assert asyncio.run(scenario()) < 0.1
+
+
+def test_edit_waits_out_a_429_on_its_own_chat():
+    pause = 0.3
+
+    async def scenario():
+        scheduler = OutboundScheduler()
+        sent, limited = {}, []
+        callback = rate_limited_once(sent, limited, pause)
+
+        await send(scheduler, "editMessageText", 7, callback("edit"))
+        return sent["edit"] - limited[0]
+
+    assert asyncio.run(scenario()) >= pause
+
+
+def test_retry_after_without_a_chat_pauses_every_sender():
+    pause = 0.3
+
+    async def scenario():
+        scheduler = OutboundScheduler(global_rate=100, global_burst=100, chat_rate=100, chat_burst=100)
+        sent, limited = {}, []
+        callback = rate_limited_once(sent, limited, pause)
+
+        first = asyncio.create_task(send(scheduler, "setMyCommands", None, callback("commands")))
+        await asyncio.sleep(0.01)
+        others = [send(scheduler, "sendMessage", 2 + i, callback(f"other{i}")) for i in range(5)]
+        await asyncio.gather(first, *others)
+        return limited[0], sent
+
+    limited_at, sent = asyncio.run(scenario())
+    assert len(sent) == 6
+    assert min(sent.values()) - limited_at >= pause
+
+
+def test_retry_after_is_raised_once_retries_are_exhausted():
+    async def scenario():
+        scheduler = OutboundScheduler(max_retries=1)
+
+        async def call():
+            raise RetryAfter(timedelta(seconds=0.01))
+
+        await send(scheduler, "sendMessage", 1, call)
+
+    with pytest.raises(RetryAfter):
+        asyncio.run(scenario())
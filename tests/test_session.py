@@ -0,0 +1,84 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+from telegram import Update
+from telegram.ext import ApplicationBuilder, ContextTypes, ConversationHandler, TypeHandler
+
+import session
+from session import MAX_HISTORY_TURNS, MODEL_ROLE, USER_ROLE, Session, evict_idle_sessions
+
+
+async def noop(update, context):
+    return None
+
+
+@pytest.fixture
+def app():
+    return ApplicationBuilder().token("1:test").context_types(ContextTypes(user_data=Session)).build()
+
+
+@pytest.fixture
+def conversation():
+    return ConversationHandler(entry_points=[TypeHandler(Update, noop)], states={}, fallbacks=[])
+
+
+def add_user(app, user_id, idle=0.0):
+    user_session = app.user_data[user_id]
+    user_session.last_seen = time.monotonic() - idle
+    return user_session
+
+
+def test_history_is_capped_and_starts_with_system_prompt():
+    user_session = Session()
+    for turn in range(MAX_HISTORY_TURNS + 5):
+        user_session.add_turn(MODEL_ROLE if turn % 2 else "user", f"turn {turn}")
+
+    history = user_session.history()
+    assert history[0]["parts"][0]["text"] == session.SYSTEM_PROMPT
+    assert len(history) == MAX_HISTORY_TURNS + 1
+    assert history[-1]["parts"][0]["text"] == f"turn {MAX_HISTORY_TURNS + 4}"
+    assert all(role is USER_ROLE or role is MODEL_ROLE for role in user_session.roles)
+
+
+def test_evicts_expired_then_least_recently_seen(app):
+    add_user(app, 1, idle=100)
+    add_user(app, 2, idle=30)
+    add_user(app, 3, idle=20)
+    add_user(app, 4, idle=10)
+
+    assert asyncio.run(evict_idle_sessions(app, ttl=60, max_count=2)) == 2
+    assert set(app.user_data) == {3, 4}
+
+
+def test_eviction_drops_the_users_conversation_state(app, conversation):
+    add_user(app, 1, idle=100)
+    add_user(app, 2)
+    conversation._conversations[(10, 1)] = 1
+    conversation._conversations[(20, 2)] = 1
+
+    asyncio.run(evict_idle_sessions(app, [conversation], ttl=60, max_count=10))
+
+    assert set(app.user_data) == {2}
+    assert dict(conversation._conversations) == {(20, 2): 1}
+
+
+def test_eviction_waits_for_the_conversation_timeout_lock(app, conversation):
+    add_user(app, 1, idle=100)
+    conversation._conversations[(10, 1)] = 1
+    removed = []
+    conversation.timeout_jobs[(10, 1)] = SimpleNamespace(schedule_removal=lambda: removed.append(True))
+
+    async def scenario():
+        async with conversation._timeout_jobs_lock:
+            eviction = asyncio.create_task(evict_idle_sessions(app, [conversation], ttl=60))
+            await asyncio.sleep(0.01)
+            # A timeout firing now holds the lock; its conversation must still be there
+            assert (10, 1) in conversation._conversations
+        await eviction
+
+    asyncio.run(scenario())
+    assert dict(conversation._conversations) == {}
+    assert conversation.timeout_jobs == {}
+    assert removed == [True]
@@ -0,0 +1,116 @@
+import json
+import re
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+import profiler
+import tracing
+from tracing import flush_traces, span, trace
+
+
+@pytest.fixture
+def trace_file(tmp_path, monkeypatch):
+    path = tmp_path / "traces.jsonl"
+    monkeypatch.setenv("TRACE_FILE", str(path))
+    monkeypatch.setenv("TRACE_SAMPLE_RATE", "1")
+    return path
+
+
+def read_spans(path):
+    flush_traces()
+    if not path.exists():
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_sampling_is_deterministic_per_update_id(trace_file, monkeypatch):
+    monkeypatch.setenv("TRACE_SAMPLE_RATE", "0.5")
+    for update_id in range(100):
+        with trace("webhook", update_id=update_id):
+            pass
+        with trace("job", update_id=update_id):
+            pass
+
+    by_trace = {}
+    for s in read_spans(trace_file):
+        by_trace.setdefault(s["traceId"], set()).add(s["name"])
+    # Roughly half are kept, and a kept webhook always comes with its job
+    assert 20 < len(by_trace) < 80
+    assert all(names == {"webhook", "job"} for names in by_trace.values())
+    assert tracing._sample_point(12345) == tracing._sample_point(12345)
+
+
+def test_child_spans_link_to_their_parent(trace_file):
+    with trace("webhook", update_id=7) as root:
+        with span("gemini.generate_content", model="m") as child:
+            with span("pil.decode"):
+                pass
+
+    spans = {s["name"]: s for s in read_spans(trace_file)}
+    assert set(spans) == {"webhook", "gemini.generate_content", "pil.decode"}
+    assert {s["traceId"] for s in spans.values()} == {root.trace_id}
+    assert spans["webhook"]["parentSpanId"] == ""
+    assert spans["gemini.generate_content"]["parentSpanId"] == root.span_id
+    assert spans["pil.decode"]["parentSpanId"] == child.span_id
+    assert spans["webhook"]["attributes"] == {"update_id": 7}
+    assert spans["gemini.generate_content"]["attributes"] == {"model": "m"}
+
+
+def test_unsampled_trace_writes_nothing(trace_file, monkeypatch):
+    monkeypatch.setenv("TRACE_SAMPLE_RATE", "0")
+    with trace("webhook", update_id=1) as root:
+        with span("child") as child:
+            assert root is None and child is None
+
+    assert read_spans(trace_file) == []
+
+
+def test_exported_lines_are_otlp_shaped_json(trace_file):
+    with pytest.raises(ValueError):
+        with trace("job", update_id=3, kind="captions"):
+            raise ValueError("boom")
+
+    (line,) = read_spans(trace_file)
+    assert line["endTimeUnixNano"] >= line["startTimeUnixNano"]
+    assert line["durationMs"] >= 0
+    assert line["attributes"]["kind"] == "captions"
+    assert "ValueError" in line["attributes"]["error"]
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "secret")
+    monkeypatch.setattr(main, "event_loop_thread_id", threading.get_ident())
+    return TestClient(main.server)
+
+
+def test_profile_requires_admin_token(client, monkeypatch):
+    assert client.get("/admin/profile?seconds=0").status_code == 403
+    assert client.get("/admin/profile?seconds=0", headers={"X-Admin-Token": "wrong"}).status_code == 403
+
+    monkeypatch.setattr(main, "ADMIN_TOKEN", None)
+    assert client.get("/admin/profile?seconds=0", headers={"X-Admin-Token": "secret"}).status_code == 403
+
+
+def test_profile_conflicts_while_another_is_running(client):
+    with profiler._profile_lock:
+        response = client.get("/admin/profile?seconds=0", headers={"X-Admin-Token": "secret"})
+    assert response.status_code == 409
+
+
+def test_profile_returns_folded_stacks_and_clamps_seconds(client, monkeypatch):
+    monkeypatch.setattr(profiler, "MAX_PROFILE_SECONDS", 0.2)
+
+    started = time.monotonic()
+    response = client.get("/admin/profile?seconds=3600&interval=0.01", headers={"X-Admin-Token": "secret"})
+    assert time.monotonic() - started < 5
+
+    assert response.status_code == 200
+    lines = response.text.splitlines()
+    assert lines
+    assert all(re.fullmatch(r".+ \(.+:\d+\)(;.+)* \d+", line) for line in lines)
@@ -0,0 +1,164 @@
+from typing import Any, Dict, Final, Iterator, List, Optional
+import setup_logging
+import logging
+
+import os
+import json
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+DEFAULT_TRACE_FILE: Final = os.path.join("logs", "traces.jsonl")
+DEFAULT_SAMPLE_RATE: Final = "0.1"
+
+
+class Span:
+    """
+    A single timed operation. Field names follow the OTLP JSON span layout.
+    """
+
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "attributes", "start_ns", "end_ns", "spans")
+
+    def __init__(self, trace_id: str, parent_id: Optional[str], name: str, attributes: Dict[str, Any], spans: List["Span"]) -> None:
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        # Finished spans of the whole trace, shared by every span in it
+        self.spans = spans
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id or "",
+            "name": self.name,
+            "startTimeUnixNano": self.start_ns,
+            "endTimeUnixNano": self.end_ns,
+            "durationMs": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "attributes": self.attributes,
+        }
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+# Finished traces are written by a background thread so the event loop never
+# waits on file I/O; when the queue is full, traces are dropped.
+MAX_PENDING_TRACES: Final = 10_000
+_export_queue: "queue.Queue[List[Span]]" = queue.Queue(maxsize=MAX_PENDING_TRACES)
+_exporter: Optional[threading.Thread] = None
+_exporter_lock = threading.Lock()
+
+
+def _write(traces: List[List[Span]]) -> None:
+    trace_file = os.getenv("TRACE_FILE", DEFAULT_TRACE_FILE)
+    try:
+        os.makedirs(os.path.dirname(trace_file) or ".", exist_ok=True)
+        with open(trace_file, "a", encoding="utf-8") as f:
+            for spans in traces:
+                for s in spans:
+                    f.write(json.dumps(s.to_dict(), default=str) + "\n")
+    except Exception as e:
+        logging.error(f"Error exporting trace: {e}")
+
+
+def _drain() -> None:
+    while True:
+        traces = [_export_queue.get()]
+        while True:
+            try:
+                traces.append(_export_queue.get_nowait())
+            except queue.Empty:
+                break
+        _write(traces)
+        for _ in traces:
+            _export_queue.task_done()
+
+
+def _export(spans: List[Span]) -> None:
+    global _exporter
+    if _exporter is None:
+        with _exporter_lock:
+            if _exporter is None:
+                _exporter = threading.Thread(target=_drain, name="trace-exporter", daemon=True)
+                _exporter.start()
+    try:
+        _export_queue.put_nowait(spans)
+    except queue.Full:
+        logging.warning("Trace export queue is full; dropping trace")
+
+
+def flush_traces() -> None:
+    """Block until every finished trace has been written."""
+    _export_queue.join()
+
+
+def _sample_point(update_id: Optional[int]) -> float:
+    """A number in [0, 1); deterministic per update_id so related traces agree."""
+    if update_id is None:
+        return random.random()
+    return ((update_id * 2654435761) % 2**32) / 2**32
+
+
+@contextmanager
+def trace(name: str, update_id: Optional[int] = None, **attributes: Any) -> Iterator[Optional[Span]]:
+    """
+    Start a new trace for one update. The sampling decision is made here, once;
+    spans opened inside an unsampled trace are no-ops. Traces that share an
+    update_id (the webhook and any job it queued) share a trace id and are
+    sampled together.
+    """
+    sample_rate = float(os.getenv("TRACE_SAMPLE_RATE", DEFAULT_SAMPLE_RATE))
+    if _sample_point(update_id) >= sample_rate:
+        token = _current_span.set(None)
+        try:
+            yield None
+        finally:
+            _current_span.reset(token)
+        return
+
+    trace_id = f"{update_id:032x}" if update_id is not None else os.urandom(16).hex()
+    root = Span(trace_id, None, name, {"update_id": update_id, **attributes}, [])
+    token = _current_span.set(root)
+    try:
+        yield root
+    except BaseException as e:
+        root.set_attribute("error", repr(e))
+        raise
+    finally:
+        _current_span.reset(token)
+        root.end_ns = time.time_ns()
+        root.spans.append(root)
+        _export(root.spans)
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Optional[Span]]:
+    """
+    Time a child operation of the current span. Does nothing outside a sampled trace.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+
+    child = Span(parent.trace_id, parent.span_id, name, attributes, parent.spans)
+    token = _current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.set_attribute("error", repr(e))
+        raise
+    finally:
+        _current_span.reset(token)
+        child.end_ns = time.time_ns()
+        child.spans.append(child)